@@ -1,5 +1,4 @@
 
-import sys
 import logging
 
 from argparse import ArgumentParser
@@ -8,10 +7,6 @@ from getpass import getpass
 from knowledge.model.association.basic.model import BasicAssociationModel
 from knowledge.util.filesys import FilesysUtil
 
-# needed for pickling/unpickling large objects
-
-sys.setrecursionlimit(10000)
-
 # command line argument parsing
 
 parser = ArgumentParser(prog='association model runner',
@@ -7,8 +7,11 @@ from enum import IntEnum
 from typing import Dict
 
 from knowledge.struct.association import Association
+from knowledge.struct.eclat import Eclat
 from knowledge.struct.fpgrowth import Fpgrowth
-from knowledge.struct.transaction import Transaction
+from knowledge.struct.store import PatternStore, TreeStore
+from knowledge.struct.toivonen import Toivonen
+from knowledge.struct.transaction import Transaction, TransactionStore
 from knowledge.struct.dimension import Dimension
 from knowledge.util.config import ConfigUtil
 from knowledge.util.filesys import FilesysUtil
@@ -90,6 +93,57 @@ class BasicAssociationModel:
                             'already exists; it will be overwritten if model is run.')
                         log.warning(config[name]["file"])
 
+        if (config['patterns']['shards'] is not None and 
+                config['patterns']['file'] is None):
+            fail += 1
+            log.error('Property "file" needs to be defined on patterns so '
+                'pattern shards can be merged into it.')
+
+        mode = config['patterns']['mode']
+        if mode != 'all' and config['patterns']['shards'] is not None:
+            fail += 1
+            log.error(f'Cannot stream {mode} patterns into shards; they have '
+                'to be filtered together.')
+        if config['patterns']['top'] is not None and (mode != 'all' or
+                config['patterns']['shards'] is not None):
+            fail += 1
+            log.error('Cannot find top patterns in closed or maximal mode nor '
+                'into shards.')
+        if config['patterns']['engine'] == 'eclat' and (mode != 'all' or
+                config['patterns']['top'] is not None or
+                config['patterns']['shards'] is not None):
+            fail += 1
+            log.error('The eclat engine only finds all patterns; it cannot be '
+                'used with closed, maximal or top modes nor with shards.')
+        if config['tree']['partitions'] is not None and (
+                config['patterns']['engine'] == 'eclat' or
+                config['patterns']['top'] is not None):
+            fail += 1
+            log.error('Transaction partitions are only mined by the fpgrowth '
+                'engine and cannot be used to find top patterns.')
+        if config['patterns']['sample'] is not None and (mode != 'all' or
+                config['patterns']['engine'] == 'eclat' or
+                config['patterns']['top'] is not None or
+                config['patterns']['shards'] is not None or
+                config['tree']['partitions'] is not None):
+            fail += 1
+            log.error('Sampled patterns are only found by the fpgrowth engine '
+                'in memory; they cannot be closed, maximal, top or sharded.')
+        if config['tree']['update'] is not None and (source != Activity.TREE or
+                config['patterns']['file'] is None or
+                config['patterns']['engine'] == 'eclat' or mode != 'all' or
+                config['patterns']['top'] is not None or
+                config['patterns']['shards'] is not None or
+                config['patterns']['sample'] is not None):
+            fail += 1
+            log.error('Updating with new transactions needs a tree source and '
+                'a patterns file to update, and only finds all patterns with '
+                'the fpgrowth engine.')
+        if mode == 'maximal' and goal == Activity.ASSOCIATIONS:
+            fail += 1
+            log.error('Cannot find associations from maximal patterns since '
+                'the supports of their subsets are lost; use closed mode.')
+
         # TODO: more error handling
 
         if fail:
@@ -115,62 +169,265 @@ class BasicAssociationModel:
         fpgrowth: Fpgrowth = None
         patterns: Dict[frozenset, int] = None
         association: Association = None
+        update = self.config['tree']['update']
+        added: Dict[int, int] = None
+        total: int = None
+
+        # patterns of at most two items are all counted in one product of
+        # the transaction matrix, which needs no tree
+
+        pairs = (source == Activity.TRANSACTIONS and 
+            goal >= Activity.PATTERNS and
+            self.config['patterns']['max_size'] == 2 and
+            self.config['patterns']['engine'] == 'fpgrowth' and
+            self.config['patterns']['mode'] == 'all' and
+            self.config['patterns']['top'] is None and
+            self.config['patterns']['shards'] is None and
+            self.config['patterns']['sample'] is None)
 
         if source == Activity.TRANSACTIONS:
             filepath = self.config['transactions']['file']
+            fmt = self.config['transactions']['format']
+            store = self.config['transactions']['store']
+            if store is not None:
+                if not FilesysUtil.file_exists(store):
+                    log.info(f'Converting transactions from {filepath} into '
+                        f'binary store {store}.')
+                    TransactionStore.from_csv(filepath, store, fmt)
+                filepath = store
+                fmt = 'csr'
             log.info(f'Loading transactions from {filepath}.')
             log.info('First transaction data scan; calculating support.')
-            support = Fpgrowth.calculate_support(filepath)
-            fpgrowth = Fpgrowth(support)
-            log.info('Second transaction data scan; building frequent pattern tree.')
-            fpgrowth.load_transactions(filepath)
+            support = Fpgrowth.calculate_support(filepath, fmt)
+            if self.config['patterns']['engine'] == 'eclat':
+                fpgrowth = Eclat(support)
+                log.info('Second transaction data scan; packing item tidsets.')
+                fpgrowth.load_transactions(filepath, fmt)
+            elif pairs:
+                fpgrowth = Fpgrowth(support)
+                log.info('Second transaction data scan; counting item pairs.')
+                patterns = fpgrowth.find_pairs(filepath, fmt,
+                    min_support=self.config['patterns']['min_support'],
+                    max_support=self.config['patterns']['max_support'])
+            elif self.config['patterns']['sample'] is not None:
+                fpgrowth = Toivonen(support, 
+                    backend=self.config['tree']['backend'])
+                log.info('Second transaction data scan; building frequent '
+                    'pattern tree of a random sample.')
+                fpgrowth.load_transactions(filepath, fmt, 
+                    dedupe=self.config['tree']['dedupe'],
+                    fraction=self.config['patterns']['sample'],
+                    seed=self.config['patterns']['seed'])
+            elif self.config['tree']['partitions'] is not None:
+                fpgrowth = Fpgrowth(support, 
+                    backend=self.config['tree']['backend'])
+                log.info('Second transaction data scan; partitioning '
+                    'transactions by item group.')
+                fpgrowth.partition_transactions(filepath,
+                    self.config['tree']['partitions'], fmt,
+                    cap=self.config['tree']['partition_cap'],
+                    dedupe=self.config['tree']['dedupe'])
+            else:
+                fpgrowth = Fpgrowth(support, 
+                    backend=self.config['tree']['backend'])
+                log.info('Second transaction data scan; building frequent '
+                    'pattern tree.')
+                fpgrowth.load_transactions(filepath, fmt, 
+                    dedupe=self.config['tree']['dedupe'])
         
         if source == Activity.TREE:
             filepath = self.config['tree']['file']
             log.info(f'Loading frequent patterns tree from {filepath}.')
-            data = multiopen(filepath, mode='rb')
-            fpgrowth = pickle.load(data)
-            data.close()
+            if TreeStore.is_store(filepath):
+                fpgrowth = TreeStore(filepath).load()
+            else:
+                log.warning(f'File {filepath} is not a tree store; loading it '
+                    'as a pickled tree.')
+                data = multiopen(filepath, mode='rb')
+                fpgrowth = pickle.load(data)
+                data.close()
 
-        if source <= Activity.TREE:
+        if source == Activity.TREE and update is not None:
+            if type(fpgrowth) is not Fpgrowth or getattr(fpgrowth, 'partitions',
+                    None):
+                log.error('Only a tree of every transaction can be updated '
+                    'with new transactions.')
+                raise ValueError
+            transactions = fpgrowth.tree.count_transactions()
+            log.info(f'Inserting new transactions from {update}.')
+            added = fpgrowth.insert_transactions(update, 
+                self.config['transactions']['format'],
+                dedupe=self.config['tree']['dedupe'])
+
+        if source <= Activity.TREE and isinstance(fpgrowth, Eclat):
+            items = len(fpgrowth.support)
+            trans = fpgrowth.transactions
+            size = fpgrowth.bitsets.nbytes
+            log.info(f'Tidsets loaded with {items} items, {trans} encounters, '
+                f'and {size} bytes.')
+        elif source <= Activity.TREE and getattr(fpgrowth, 'partitions', None):
+            items = len(fpgrowth.support)
+            parts = len(fpgrowth.partitions)
+            trans = fpgrowth.partitions[0].transactions
+            size = sum(part.occurrences for part in fpgrowth.partitions)
+            log.info(f'Partitions loaded with {items} items, {trans} '
+                f'encounters, {parts} partitions, and {size} item occurrences.')
+        elif source <= Activity.TREE and not pairs:
             items = len(fpgrowth.support)
-            trans = fpgrowth.tree.root.count
-            events = sum(n.count for item in fpgrowth.tree.nodes.values()
-                for n in item) - trans
-            nodes = sum(len(item) for item in fpgrowth.tree.nodes.values())
+            trans = fpgrowth.tree.count_transactions()
+            events = fpgrowth.tree.count_events()
+            nodes = fpgrowth.tree.count_nodes()
             log.info(f'Tree loaded with {items} items, {trans} encounters, '
                 f'{events} events, and {nodes} nodes.')
 
-        if source < Activity.TREE and goal >= Activity.TREE:
-            if self.config['tree']['save']:
-                log.info(f'Saving frequent patterns tree to {filepath}.')
+        # the minimum support of associations is a share of every encounter
+        # the patterns were found in; a sample tree only holds some of them
+
+        if isinstance(fpgrowth, (Eclat, Toivonen)) or pairs:
+            total = fpgrowth.transactions
+        elif getattr(fpgrowth, 'partitions', None):
+            total = fpgrowth.partitions[0].transactions
+        elif fpgrowth is not None:
+            total = fpgrowth.tree.count_transactions()
+
+        if (source < Activity.TREE or update is not None) and \
+                goal >= Activity.TREE:
+            if pairs and self.config['tree']['save']:
+                log.info('Not saving frequent patterns tree; pairs were '
+                    'counted without building it.')
+            elif self.config['tree']['save']:
                 filepath = self.config['tree']['file']
-                data = multiopen(filepath, mode='wb')
-                pickle.dump(fpgrowth, data)
-                data.close()
+                log.info(f'Saving frequent patterns tree to {filepath}.')
+                TreeStore.write(filepath, fpgrowth)
 
         if source == Activity.PATTERNS:
             filepath = self.config['patterns']['file']
             log.info(f'Loading patterns from {filepath}.')
-            patterns = Fpgrowth.load_patterns(filepath)
+            if PatternStore.is_store(filepath):
+                patterns = PatternStore(filepath)
+            else:
+                patterns = Fpgrowth.load_patterns(filepath)
+            total = Fpgrowth.read_transactions(filepath)
 
-        if source < Activity.PATTERNS and goal >= Activity.PATTERNS:
+        if update is not None and goal >= Activity.PATTERNS:
+            filepath = self.config['patterns']['file']
+            log.info(f'Loading patterns from {filepath} to update.')
+            patterns = {frozenset(fpgrowth.ranks[item] for item in pattern): 
+                support for pattern, support in 
+                Fpgrowth.load_patterns(filepath).items()}
+            patterns, delta = fpgrowth.update_patterns(patterns, added,
+                transactions,
+                min_support=self.config['patterns']['min_support'],
+                max_support=self.config['patterns']['max_support'],
+                max_size=self.config['patterns']['max_size'],
+                cores=self.config['run']['cores'],
+                fparray=self.config['patterns']['fparray'],
+                split=self.config['patterns']['split'],
+                share=self.config['patterns']['share'],
+                interval=self.config['run']['progress'],
+                hybrid=self.config['patterns']['hybrid'])
+            if self.config['patterns']['delta'] is not None:
+                deltapath = self.config['patterns']['delta']
+                log.info(f'Saving pattern delta to {deltapath}.')
+                Fpgrowth.write_patterns(delta, deltapath, fpgrowth.items,
+                    transactions=total)
+            if self.config['patterns']['save']:
+                log.info(f'Applying pattern delta to {filepath}.')
+                Fpgrowth.apply_delta(filepath, delta, fpgrowth.items, total)
+        elif pairs:
+            if self.config['patterns']['save']:
+                filepath = self.config['patterns']['file']
+                log.info(f'Saving patterns to {filepath}.')
+                Fpgrowth.write_patterns(patterns, filepath, fpgrowth.items,
+                    self.config['patterns']['format'], total)
+        elif (source < Activity.PATTERNS and goal >= Activity.PATTERNS and
+                isinstance(fpgrowth, Eclat)):
             patterns = fpgrowth.find_patterns(
                 min_support=self.config['patterns']['min_support'],
                 max_support=self.config['patterns']['max_support'],
                 max_size=self.config['patterns']['max_size'],
-                cores=self.config['run']['cores'])
+                cores=self.config['run']['cores'],
+                interval=self.config['run']['progress'])
             if self.config['patterns']['save']:
                 filepath = self.config['patterns']['file']
                 log.info(f'Saving patterns to {filepath}.')
-                Fpgrowth.write_patterns(patterns, filepath)
+                Fpgrowth.write_patterns(patterns, filepath, fpgrowth.items,
+                    self.config['patterns']['format'], total)
+        elif (source < Activity.PATTERNS and goal >= Activity.PATTERNS and
+                isinstance(fpgrowth, Toivonen)):
+            patterns = fpgrowth.find_patterns(
+                min_support=self.config['patterns']['min_support'],
+                max_support=self.config['patterns']['max_support'],
+                max_size=self.config['patterns']['max_size'],
+                cores=self.config['run']['cores'],
+                confidence=self.config['patterns']['confidence'],
+                fparray=self.config['patterns']['fparray'],
+                split=self.config['patterns']['split'],
+                share=self.config['patterns']['share'],
+                interval=self.config['run']['progress'],
+                hybrid=self.config['patterns']['hybrid'])
+            if self.config['patterns']['verify']:
+                log.info('Third transaction data scan; verifying sampled '
+                    'patterns.')
+                patterns, _ = fpgrowth.verify_patterns(patterns,
+                    min_support=self.config['patterns']['min_support'],
+                    max_support=self.config['patterns']['max_support'],
+                    max_size=self.config['patterns']['max_size'])
+            else:
+                patterns = fpgrowth.bound_patterns(patterns,
+                    min_support=self.config['patterns']['min_support'],
+                    max_support=self.config['patterns']['max_support'])
+            if self.config['patterns']['save']:
+                filepath = self.config['patterns']['file']
+                log.info(f'Saving patterns to {filepath}.')
+                Fpgrowth.write_patterns(patterns, filepath, fpgrowth.items,
+                    self.config['patterns']['format'], total)
+        elif source < Activity.PATTERNS and goal >= Activity.PATTERNS:
+            shards = self.config['patterns']['shards']
+            patterns = fpgrowth.find_patterns(
+                min_support=self.config['patterns']['min_support'],
+                max_support=self.config['patterns']['max_support'],
+                max_size=self.config['patterns']['max_size'],
+                cores=self.config['run']['cores'],
+                fparray=self.config['patterns']['fparray'],
+                split=self.config['patterns']['split'],
+                share=self.config['patterns']['share'],
+                interval=self.config['run']['progress'],
+                shards=shards,
+                mode=self.config['patterns']['mode'],
+                top=self.config['patterns']['top'] or 0,
+                min_size=self.config['patterns']['min_size'],
+                hybrid=self.config['patterns']['hybrid'])
+            if shards is not None:
+                filepath = self.config['patterns']['file']
+                log.info(f'Merging pattern shards into {filepath}.')
+                Fpgrowth.merge_patterns(patterns, filepath, fpgrowth.items,
+                    fmt=self.config['patterns']['format'], transactions=total)
+                if goal == Activity.ASSOCIATIONS:
+                    log.info(f'Loading patterns from {filepath}.')
+                    if self.config['patterns']['format'] == 'binary':
+                        patterns = PatternStore(filepath)
+                    else:
+                        patterns = Fpgrowth.load_patterns(filepath)
+                    fpgrowth = None
+            elif self.config['patterns']['save']:
+                filepath = self.config['patterns']['file']
+                log.info(f'Saving patterns to {filepath}.')
+                Fpgrowth.write_patterns(patterns, filepath, fpgrowth.items,
+                    self.config['patterns']['format'], total)
 
         if goal == Activity.ASSOCIATIONS:
             filepath = self.config['associations']['file']
             log.info(f'Finding associations and dumping into {filepath}.')
-            association = Association(patterns)
+            items = fpgrowth.items if fpgrowth is not None else None
+            if isinstance(patterns, PatternStore):
+                items = patterns.items
+            closed = self.config['patterns']['mode'] == 'closed'
+            association = Association(patterns, items, closed, total)
             association.find_associations(filepath,
                 min_support=self.config['associations']['min_support'],
                 min_confidence=self.config['associations']['min_confidence'],
-                cores=self.config['run']['cores'])
+                cores=self.config['run']['cores'],
+                interval=self.config['run']['progress'],
+                max_size=self.config['patterns']['max_size'])
             
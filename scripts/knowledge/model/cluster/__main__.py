@@ -1,4 +1,3 @@
-import sys
 import logging
 
 from argparse import ArgumentParser
@@ -7,10 +6,6 @@ from getpass import getpass
 from knowledge.model.cluster.model import ClusterModel
 from knowledge.util.filesys import FilesysUtil
 
-# needed for pickling/unpickling large objects
-
-sys.setrecursionlimit(10000)
-
 # command line argument parsing
 
 parser = ArgumentParser(prog='cluster model runner',
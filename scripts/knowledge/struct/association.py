@@ -5,17 +5,17 @@ import csv
 import os
 import logging as log
 
-from itertools import combinations
+from itertools import combinations, groupby
 from collections import defaultdict
-from multiprocessing import Pool, Manager, Value
-from ctypes import c_uint64
+from multiprocessing import Pool, Manager
 
 from knowledge.struct.fpgrowth import Fpgrowth
+from knowledge.struct.store import PatternStore
 from knowledge.util.filesys import FilesysUtil
+from knowledge.util.progress import ProgressUtil
 
 
-count = None
-n = None
+progress = None
 
 
 def multiopen(filepath, **kwargs):
@@ -28,6 +28,13 @@ def multiopen(filepath, **kwargs):
     return data
 
 
+def track(shared):
+    'pool initializer; claims a progress counter slot for the worker'
+    global progress
+    progress = shared
+    progress.claim()
+
+
 def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
@@ -62,25 +69,57 @@ def write_associations(queue, filepath, cols):
     log.debug(f'Associations writer finished.')
 
 
-def find_associations(queue, patterns, keys, min_support, min_confidence):
+def find_associations(queue, patterns, keys, min_support, min_confidence,
+        items=None, closed=False, max_size=0):
     '''find associations in pattern chucnk and add to write queue
 
+    Patterns below the minimum support are skipped before any of their
+    subsets are looked up. The consequents of the rules of a pattern are
+    grown one item at a time, as apriori grows patterns, only from
+    consequents whose rule met the minimum confidence.
+
     Parameters
     ----------
     queue: multiprocessing.Queue
         File write queue as provided by the multiprocessing manager.
 
-    patterns: dict{frozenset[str]: float}
-        Dictionary of frequent patterns where a frozenset of items map
-        to their corresponding support.
+    patterns: PatternTrie / PatternStore
+        Index of frequent patterns to look the supports of the subsets of
+        every pattern up in.
 
-    keys: list[frozenset[str]]
-        List of frozensets that are keys to the patterns dictionary;
-        these patterns will be analyzed for association finding.
+    keys: list[list[str/int]] / range
+        List of the sorted items of patterns in the index, best in sorted
+        order, or the range of pattern numbers of a pattern store; these
+        patterns will be analyzed for association finding.
 
     min_support: float
-
-    min_confidence: float   '''
+        Minimum number of transactions a pattern needs to be in for its
+        rules to be generated.
+
+    min_confidence: float
+
+    items: list[str] = None
+        Item dictionary to decode item ranks with if patterns were found
+        by `Fpgrowth`; if None, patterns items are written as is.
+
+    closed: bool = False
+        Patterns are closed patterns; the support of an itemset missing from
+        patterns is then derived as the greatest support of the patterns
+        containing it, as found by `supersets` of the index. Rules are then
+        generated from every subset of a closed pattern that owns it: the
+        subset has the same support, and of the patterns containing it
+        with that support, this one comes first in sorted order. So each
+        frequent itemset is analyzed once, even if patterns were cut short
+        by a maximum size and several share its support.
+
+    max_size: int = 0
+        Maximum number of items of the subsets of closed patterns rules are
+        generated from; 0 is unbounded.
+
+    Returns
+    -------
+    count: int
+        Number of patterns analyzed.    '''
 
     log.debug(f'Association mining proccess {os.getpid()} starting.')
     inf = float('inf')
@@ -93,53 +132,265 @@ def find_associations(queue, patterns, keys, min_support, min_confidence):
         'conviction': lambda sAC, sA, sC: (1-sC)/(1-sAC/sA) \
             if sAC != sA else inf   }
     
+    derived = {}
+    if not closed:
+        lookup = patterns.__getitem__
+    else:
+        def closure(itemset):
+            'support of an itemset and the sorted items of its owner'
+            if itemset not in derived:
+                supersets = patterns.supersets(itemset)
+                support = max(count for _, count in supersets)
+                owner = min(sorted(pattern) for pattern, count in supersets
+                    if count == support)
+                derived[itemset] = (support, owner)
+            return derived[itemset]
+
+        def lookup(itemset):
+            support = patterns.get(itemset)
+            return closure(itemset)[0] if support is None else support
+
+    if isinstance(keys, range):
+        keys = (sorted(pattern) for pattern, _ in 
+            patterns.patterns(keys.start, keys.stop))
+
+    def closures(key):
+        '''subsets of a closed pattern which it owns, largest first
+
+        Supports only rise as items are dropped, so once a subset has a
+        greater support, or another owner, so do all of its own subsets;
+        a subset is only looked up if every subset one item larger within
+        the pattern was owned.  '''
+
+        support = patterns.get(key)
+        if support < min_support:
+            return
+        top = min(len(key), max_size or len(key))
+        level = list(combinations(key, top))
+        while level and len(level[0]) >= 2:
+            kept = [subset for subset in level
+                if closure(frozenset(subset)) == (support, key)]
+            yield from map(list, kept)
+            owned = set(kept)
+            level = []
+            for candidate in dict.fromkeys(subset[:idx] + subset[idx + 1:]
+                    for subset in kept for idx in range(len(subset))):
+                members = set(candidate)
+                if all(tuple(item for item in key 
+                        if item in members or item == extra) in owned
+                        for extra in key if extra not in members):
+                    level.append(candidate)
+
     associations = []
     local_count = 0
+    count = 0
     for pattern in keys:
-        sAC = patterns[pattern]
-        for idx in range(len(pattern)-1,0,-1):
-            for subset in combinations(pattern, r=idx):
-                antecedent = frozenset(subset)
-                consequent = pattern - antecedent
-
-                sA = patterns[antecedent]
-                sC = patterns[consequent]
-
-                score = (metrics['support'](sAC, sA, sC) >= min_support and
-                    metrics['confidence'](sAC, sA, sC) >= min_confidence)
-
-                if score:
-                    if count.value >= n.value:
-                        log.info(f'Found association {count.value}.')
-                        with n.get_lock():
-                            n.value <<= 1
-                    
+        count += 1
+        for key in (closures(pattern) if closed else (pattern,)):
+            if len(key) < 2:
+                continue
+            sAC = patterns.get(key)
+            if sAC is None:
+                sAC = lookup(frozenset(key))
+            if sAC < min_support:
+                continue
+            full = (1 << len(key)) - 1
+            bits = [(1 << idx, item) for idx, item in enumerate(key)]
+
+            # subsets are looked up by bitmask only once a rule needs them,
+            # so those of consequents that were pruned are never fetched
+            supports = {full: sAC}
+            def support(mask):
+                if mask not in supports:
+                    supports[mask] = lookup(frozenset(item 
+                        for bit, item in bits if mask & bit))
+                return supports[mask]
+
+            # consequents grow one item at a time from those of rules that met
+            # the minimum confidence; growing a consequent shrinks the
+            # antecedent, whose support can only rise, so confidence only drops
+            level = [(idx,) for idx in range(len(key))]
+            while level and len(level[0]) < len(key):
+                passed = []
+                for positions in level:
+                    mask = full ^ sum(1 << idx for idx in positions)
+                    sA = support(mask)
+                    if metrics['confidence'](sAC, sA, None) < min_confidence:
+                        continue
+                    sC = support(full ^ mask)
+                    passed.append(positions)
+
                     if local_count >= 100000:
                         queue.put(associations)
                         associations = []
                         local_count = 0 
-                        
+
+                    antecedent = [item for bit, item in bits if mask & bit]
+                    consequent = [item for bit, item in bits if not mask & bit]
+                    if items is not None:
+                        names = (sorted(items[item] for item in antecedent),
+                            sorted(items[item] for item in consequent))
+                    else:
+                        names = (antecedent, consequent)
+
                     associations.append((
-                        ','.join(sorted(antecedent)),
-                        ','.join(sorted(consequent)),
+                        ','.join(names[0]),
+                        ','.join(names[1]),
                         metrics['support'](sAC, sA, sC),
                         metrics['confidence'](sAC, sA, sC),
                         metrics['lift'](sAC, sA, sC),
                         metrics['leverage'](sAC, sA, sC),
-                        metrics['conviction'](sAC, sA, sC) if sAC != sA else None,
+                        metrics['conviction'](sAC, sA, sC) 
+                            if sAC != sA else None,
                         metrics['rpf'](sAC, sA, sC)))
 
                     local_count += 1
-                    with count.get_lock():
-                        count.value += 1
+                    progress.add()
+
+                found = set(passed)
+                level = []
+                for prefix, group in groupby(passed, 
+                        key=lambda positions: positions[:-1]):
+                    for first, second in combinations(
+                            [positions[-1] for positions in group], 2):
+                        candidate = prefix + (first, second)
+                        if all(candidate[:idx] + candidate[idx + 1:] in found
+                                for idx in range(len(prefix))):
+                            level.append(candidate)
 
     queue.put(associations)
+    progress.flush()
     log.debug(f'Association mining proccess {os.getpid()} finished.')
+    return count
+
+
+class PatternTrie:
+    '''prefix trie of frequent patterns over their sorted items
+
+    Every node maps the next item of its patterns to a list of the support
+    of the pattern ending there, None if that prefix is not a pattern, and
+    the children of that pattern, None if it has no children. Since the
+    items of a pattern are sorted, every subset of a pattern is a path
+    through the trie, looked up one item at a time, and patterns sharing
+    a prefix share its nodes.
+
+    Parameters
+    ----------
+    patterns: dict{frozenset[str/int]: int} = None
+        Frequent patterns mapped to their support.
+
+    postings: bool = False
+        Also keep the patterns containing each item, for `supersets`.  '''
+
+    def __init__(self, patterns=None, postings=False):
+        self.root = {}
+        self.count = 0
+        self.postings = defaultdict(set) if postings else None
+        for pattern, support in (patterns or {}).items():
+            self.insert(sorted(pattern), support)
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __contains__(self, pattern):
+        return self.get(pattern) is not None
+
+
+    def __getitem__(self, pattern):
+        support = self.get(pattern)
+        if support is None:
+            raise KeyError(pattern)
+        return support
+
+
+    def insert(self, key, support):
+        '''insert a pattern into the trie
+
+        Parameters
+        ----------
+        key: list[str/int]
+            Sorted items of the pattern.
+
+        support: int   '''
+
+        children = self.root
+        for item in key[:-1]:
+            node = children.setdefault(item, [None, None])
+            if node[1] is None:
+                node[1] = {}
+            children = node[1]
+        node = children.setdefault(key[-1], [None, None])
+        if node[0] is None:
+            self.count += 1
+        node[0] = support
+        if self.postings is not None:
+            pattern = frozenset(key)
+            for item in key:
+                self.postings[item].add(pattern)
+
+
+    def get(self, pattern, default=None):
+        '''support of a pattern, in any order of its items'''
+        node = [None, self.root]
+        for item in sorted(pattern):
+            node = node[1].get(item) if node[1] is not None else None
+            if node is None:
+                return default
+        return default if node[0] is None else node[0]
+
+
+    def supersets(self, key):
+        '''patterns holding every item of a pattern, itself included; only
+        if the trie keeps postings
+
+        Parameters
+        ----------
+        key: iterable[str/int]
+            Items of the pattern.
+
+        Returns
+        -------
+        supersets: list[tuple(frozenset[str/int], int)]
+            The supersets and their support.   '''
+
+        postings = sorted((self.postings.get(item, set()) for item in key),
+            key=len)
+        return [(pattern, self.get(pattern)) 
+            for pattern in set.intersection(*postings)]
 
 
 class Association:
-    def __init__(self, patterns):
+    '''association rule mining from frequent patterns
+
+    Parameters
+    ----------
+    patterns: dict{frozenset[str/int]: int} / PatternStore
+        Frequent patterns mapped to their support, or a pattern store;
+        workers open the store themselves and look patterns up in its
+        index, and closed pattern supersets up in its postings, rather than
+        receiving a copy of every pattern.
+
+    items: list[str] = None
+        Item dictionary to decode item ranks with; see `Fpgrowth.items`.
+
+    closed: bool = False
+        Patterns are only the closed patterns, as found by `Fpgrowth` in
+        closed mode; rules are generated from every frequent itemset they
+        stand for, whose supports are derived from the closed patterns
+        containing them, so all patterns would yield the same rules.
+
+    transactions: int = None
+        Number of transactions the patterns were found in; the minimum
+        support of `find_associations` is a fraction of it, so it is needed
+        for any minimum support.  '''
+
+    def __init__(self, patterns, items=None, closed=False, transactions=None):
         self.patterns = patterns
+        self.items = items
+        self.closed = closed
+        self.transactions = transactions
 
     
     @classmethod
@@ -168,36 +419,64 @@ class Association:
 
 
     def find_associations(self, filepath, min_support=0, min_confidence=0, 
-            cores=None):
-        'find associations from frequent patterns dictionary'
+            cores=None, interval=60, max_size=0):
+        '''find associations from frequent patterns dictionary
+
+        Workers count the rules they find locally and flush their counts to
+        shared slots now and then; rules found per second and the estimated
+        time left are logged every `interval` seconds. Patterns with more
+        than `max_size` items, which closed mode may find, only yield rules
+        from their subsets of at most `max_size` items. Patterns found in
+        less than `min_support` of the transactions yield no rules.    '''
+
+        if self.transactions is None and min_support > 0:
+            raise ValueError('Number of transactions the patterns were found '
+                'in is unknown; associations cannot be filtered by minimum '
+                'support. Write the patterns again with it, or set no minimum '
+                'support.')
+        min_support = min_support * (self.transactions or 0)
 
         log.info(f'Balancing patterns into tasks for {cores} cores.')
 
-        global count, n
-        count = Value(c_uint64)
-        count.value = 0
-        n = Value(c_uint64)
-        n.value = 1
+        global progress
+        progress = ProgressUtil('association', (cores or os.cpu_count()) + 1,
+            interval)
 
         manager = Manager()
         queue = manager.Queue(maxsize=10)
-        pool = Pool(processes=cores)
+        pool = Pool(processes=cores, initializer=track, initargs=(progress,))
 
         cols = ('antecedent', 'consequent', 'support', 'confidence', 'lift',
             'leverage', 'conviction', 'rpf')
         pool.apply_async(write_associations, (queue, filepath, cols))
 
-        chunksize = max(len(self.patterns) // (cores * 4), 1)
-        jobs = chunks(list(self.patterns.keys()), chunksize)
-        tasks = ((queue, self.patterns, keys, min_support, min_confidence) 
-            for keys in jobs)
+        bound = 0 if self.closed else max_size
+        if isinstance(self.patterns, PatternStore):
+            patterns = self.patterns
+            keys = range(self.patterns.size(bound))
+        else:
+            patterns = PatternTrie(self.patterns, postings=self.closed)
+            keys = sorted(sorted(pattern) for pattern in self.patterns 
+                if bound == 0 or len(pattern) <= bound)
+        chunksize = max(len(keys) // (cores * 4), 1)
+        jobs = chunks(keys, chunksize)
+        tasks = ((queue, patterns, keys, min_support, min_confidence,
+            self.items, self.closed, max_size) for keys in jobs)
 
         log.info(f'Finding associations on {cores} cores.')
-        pool.starmap(find_associations, tasks)
+        progress.begin()
+        progress.update(0, len(keys), 'patterns')
+        done = 0
+        def analyzed(keys):
+            nonlocal done
+            done += keys
+            progress.update(done)
+        results = [pool.apply_async(find_associations, task, 
+            callback=analyzed) for task in tasks]
+        for result in results:
+            result.get()
         queue.put('kill')
         pool.close()
         pool.join()
-
-        if count.value != n.value >> 1:
-            log.info(f'Found association {count.value}.')
+        progress.end()
         
\ No newline at end of file
@@ -0,0 +1,332 @@
+
+import os
+import time
+import numpy as np
+import logging as log
+
+from array import array
+from multiprocessing import Pool
+
+from knowledge.struct.fpgrowth import Fpgrowth
+from knowledge.util.progress import ProgressUtil
+
+
+progress = None
+bitsets = None
+
+# number of set bits of every byte value
+
+popcounts = np.array([bin(byte).count('1') for byte in range(256)],
+    dtype=np.uint8)
+
+
+def popcount(bits):
+    'number of set bits in a packed bit array'
+    return int(popcounts[bits].sum(dtype=np.uint64))
+
+
+def pack_rows(rows, ranks, items, size):
+    '''pack row/rank coordinates of a block of transactions straight into a
+    bitset per item, without a dense (rows, items) block in between
+
+    Parameters
+    ----------
+    rows: numpy.ndarray[int]
+        Row of every coordinate within the block.
+
+    ranks: numpy.ndarray[int]
+        Item rank, or bitset index, of every coordinate.
+
+    items: int
+        Number of bitsets.
+
+    size: int
+        Number of transactions in the block.
+
+    Returns
+    -------
+    bitsets: numpy.ndarray[uint8]
+        An (items, bytes) array of packed bits, where bit `row % 8` of byte
+        `row // 8` of `bitsets[rank]` is set for every coordinate.    '''
+
+    bitsets = np.zeros((items, (size + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(bitsets, (ranks, rows >> 3), 
+        np.left_shift(1, rows & 7).astype(np.uint8))
+    return bitsets
+
+
+def track(shared, matrix):
+    '''pool initializer; claims a progress counter slot for the worker and
+    keeps the tidsets of every item'''
+    global progress, bitsets
+    progress = shared
+    progress.claim()
+    bitsets = matrix
+
+
+def find_patterns(item, candidates, supports, min_support, max_support,
+        max_size):
+    '''pattern finding function for a single thread; mines the equivalence
+    class of the patterns whose least frequent item is item
+
+    Returns
+    -------
+    patterns: list[tuple(int, list[int])]
+
+    duration: float
+        Seconds spent on the task.
+
+    candidates: int
+        Number of items the class was extended with.    '''
+
+    start = time.perf_counter()
+    patterns = []
+    for pattern in Eclat.generate_patterns(bitsets, item, candidates,
+            supports, min_support, max_support, max_size):
+        patterns.append(pattern)
+        progress.add()
+    progress.flush()
+    return patterns, time.perf_counter() - start, len(candidates)
+
+
+class Eclat:
+    '''vertical frequent pattern mining with packed bitset tidlists
+
+    Every item keeps the set of transactions it occurs in as a packed bit
+    array, one bit per transaction. Patterns are found depth first by
+    intersecting the tidsets of the first two items of a pattern; deeper
+    levels keep diffsets instead (dEclat), the transactions of the prefix
+    that a pattern lacks, so supports are the prefix support less the
+    number of set bits. Dense data with few distinct items, where tidsets
+    are long, favours this over growing conditional trees.
+
+    Reads the same transaction files and finds the same patterns, keyed by
+    the same item ranks, as `Fpgrowth`; it only replaces the tree with the
+    bitsets. It is an engine of its own rather than an `Fpgrowth`, since it
+    has no tree to update, partition or mine with the options of one; it
+    only shares the decoding of transactions, and patterns are read and
+    written with `Fpgrowth.load_patterns` and `Fpgrowth.write_patterns`.
+
+    Parameters
+    ----------
+    support: dict{str: int}
+        A dictionary mapping the names of items to their support.
+
+    Attributes
+    ----------
+    bitsets: numpy.ndarray[uint8]
+        An (items, bytes) array of packed tidsets, indexed by item rank.
+
+    transactions: int
+        Number of transactions loaded.  '''
+
+    def __init__(self, support):
+        self.support = support
+        self.items = sorted(support, key=lambda item: (-support[item], item))
+        self.ranks = {item: rank for rank, item in enumerate(self.items)}
+        self.bitsets = np.zeros((len(self.items), 0), dtype=np.uint8)
+        self.transactions = 0
+
+
+    encode_transactions = Fpgrowth.encode_transactions
+
+
+    @classmethod
+    def generate_patterns(self, bitsets, item, candidates, supports,
+            min_support=0, max_support=1, max_size=0):
+        '''generates the frequent patterns whose least frequent item is item
+
+        Items are added in descending rank, as `Fpgrowth` projects them,
+        so a pattern is kept only if every prefix of it in that order has
+        a support within bounds; classes are mined off an explicit stack.
+
+        Parameters
+        ----------
+        bitsets: numpy.ndarray[uint8]
+            Packed tidsets of every item, indexed by rank.
+
+        item: int
+            The item heading the equivalence class.
+
+        candidates: list[int]
+            Items to extend the class with, from the least frequent; they
+            should all be more frequent than item.
+
+        supports: list[int]
+            The support of every item, indexed by rank.
+
+        min_support: int
+
+        max_support: int
+
+        max_size: int
+
+        Yields
+        ------
+        pattern: tuple(int, list[int])  '''
+
+        tidset = bitsets[item]
+        support = supports[item]
+        members = []
+        for other in candidates:
+            diffset = tidset & ~bitsets[other]
+            count = support - popcount(diffset)
+            if count >= min_support and count <= max_support:
+                members.append((other, diffset, count))
+
+        stack = [([item], members)]
+        while stack:
+            prefix, members = stack.pop()
+            for idx, (other, diffset, count) in enumerate(members):
+                pattern = prefix + [other]
+                yield count, pattern
+                if max_size and len(pattern) >= max_size:
+                    continue
+
+                # the diffset of pattern + x is the diffset of prefix + x
+                # less the transactions missing from pattern
+
+                extensions = []
+                for last, rest, total in members[idx + 1:]:
+                    diff = rest & ~diffset
+                    total = count - popcount(diff)
+                    if total >= min_support and total <= max_support:
+                        extensions.append((last, diff, total))
+                if extensions:
+                    stack.append((pattern, extensions))
+
+
+    def load_transactions(self, filepath, fmt='auto', chunksize=65536):
+        '''stream a transactions file into packed item tidsets
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions file; gzipped if it ends with ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        chunksize: int = 65536
+            Number of transactions to pack at a time; kept a multiple of
+            eight so blocks pack onto whole bytes. Only the item ranks of a
+            block are buffered, so memory is bound by its occurrences and
+            its packed bits, not by its rows times every item. '''
+
+        chunksize = max(chunksize - chunksize % 8, 8)
+        blocks = []
+        rows = array('q')
+        ranks = array('q')
+        size = 0
+        count = 0
+        n = 1
+
+        def pack():
+            return pack_rows(np.array(rows, dtype=np.int64), 
+                np.array(ranks, dtype=np.int64), len(self.items), size)
+
+        for itemset in self.encode_transactions(filepath, fmt, chunksize):
+            rows.extend([size] * len(itemset))
+            ranks.extend(itemset)
+            size += 1
+            count += 1
+            if size == chunksize:
+                blocks.append(pack())
+                rows = array('q')
+                ranks = array('q')
+                size = 0
+            if count == n:
+                log.info(f'Processed transaction {count}.')
+                n <<= 1
+
+        if size:
+            blocks.append(pack())
+        if count != n >> 1:
+            log.info(f'Processed transaction {count}.')
+
+        self.transactions = count
+        if blocks:
+            self.bitsets = np.ascontiguousarray(np.concatenate(blocks, axis=1))
+        log.info(f'Packed tidsets of {len(self.items)} items over {count} '
+            f'transactions into {self.bitsets.nbytes} bytes.')
+
+
+    def find_patterns(self, min_support=0, max_support=1, max_size=0,
+            cores=None, interval=60):
+        '''finds patterns from the tidsets using multiprocessing
+
+        Every item heads an equivalence class of the patterns it is the
+        least frequent item of; classes are tasks handed to idle workers,
+        those with the most candidate items first. Workers inherit the
+        tidsets once through the pool initializer.
+
+        Parameters
+        ----------
+        min_support: float
+            The minimum support of a pattern for it to be included in the
+            list of frequent patterns.
+
+        max_support: float
+
+        max_size: int
+
+        cores: int/None
+            Number of cores to utilize; default is None, which will auto detect
+            the number of cores available to use.
+
+        interval: float = 60
+            Seconds between progress reports.
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            A dictionary mapping patterns, as sets of item ranks, to their
+            support; decode ranks with `items`. '''
+
+        workers = os.cpu_count() if cores is None else cores
+        min_support = max(min_support * self.transactions, 1)
+        max_support = max_support * self.transactions
+        supports = [popcount(bits) for bits in self.bitsets]
+        patterns = [(support, [item]) for item, support in enumerate(supports)
+            if support]
+
+        # only frequent items can extend a class, and only classes of
+        # frequent items can have patterns beyond the item itself
+
+        frequent = [item for item, support in enumerate(supports)
+            if support >= min_support]
+        tasks = []
+        if max_size != 1:
+            for idx, item in enumerate(frequent):
+                if idx:
+                    tasks.append((item, frequent[idx - 1::-1], supports,
+                        min_support, max_support, max_size))
+        tasks.sort(key=lambda task: len(task[1]), reverse=True)
+
+        global progress
+        progress = ProgressUtil('pattern', workers + 1, interval)
+        progress.begin()
+        progress.add(len(patterns))
+
+        log.info(f'Finding patterns in {len(tasks)} equivalence classes on '
+            f'{workers} cores.')
+
+        start = time.perf_counter()
+        durations = []
+        pool = Pool(processes=workers, initializer=track,
+            initargs=(progress, self.bitsets))
+        def collect(result):
+            found, duration, candidates = result
+            patterns.extend(found)
+            durations.append((duration, candidates, 0))
+            progress.update(len(durations), len(tasks), 'classes')
+        results = [pool.apply_async(find_patterns, task, callback=collect)
+            for task in tasks]
+        for result in results:
+            result.get()
+        pool.close()
+        pool.join()
+        progress.end()
+        Fpgrowth.log_tasks(durations, time.perf_counter() - start, workers)
+
+        return {frozenset(pattern[1]): pattern[0] for pattern in patterns}
@@ -1,18 +1,34 @@
 
 import gzip
 import csv
+import os
+import time
 import pandas as pd
 import numpy as np
 import logging as log
 
+from array import array
 from collections import defaultdict
 from itertools import combinations
-from multiprocessing import Pool, Value
+from heapq import heappush, heapreplace
+from multiprocessing import Pool, Value, get_context, get_all_start_methods
+from multiprocessing.util import Finalize
+from queue import Queue
 from ctypes import c_uint64
+from scipy import sparse
 
+from knowledge.struct.store import PatternShard, PatternStore, \
+    TransactionPartition
+from knowledge.struct.transaction import Transaction, TransactionStore, \
+    split_rows
+from knowledge.util.progress import ProgressUtil
 
-count = None
-n = None
+
+progress = None
+master = None
+shard = None
+threshold = None
+ranked = None
 
 
 def multiopen(filepath, **kwargs):
@@ -25,21 +41,147 @@ def multiopen(filepath, **kwargs):
     return data
 
 
-def find_patterns(tree, min_support, max_support, max_size):
-    'pattern finding function for a single thread'
+def track(shared, shards=None, bound=None):
+    '''pool initializer; claims a progress counter slot for the worker,
+    opens the worker's pattern shard if a shard directory is given and
+    keeps the shared top-k support threshold if one is given'''
+    global progress, shard, threshold, ranked
+    progress = shared
+    progress.claim()
+    shard = None
+    if shards is not None:
+        shard = PatternShard.create(shards)
+        Finalize(shard, shard.close, exitpriority=10)
+    threshold = bound
+    ranked = []
+
+
+def rank(heap, support, top):
+    '''push the support of a pattern onto a heap of the top supports this
+    process found; once the heap is full, its smallest support bounds the
+    support of the k-th most frequent pattern, so the shared threshold is
+    raised to it'''
+
+    if len(heap) < top:
+        heappush(heap, support)
+    elif support > heap[0]:
+        heapreplace(heap, support)
+    else:
+        return
+    if len(heap) == top and heap[0] > threshold.value:
+        with threshold.get_lock():
+            threshold.value = max(threshold.value, heap[0])
 
-    generator = Fpgrowth.generate_patterns(tree, min_support, 
-        max_support, max_size)
-    patterns = []
-    for pattern in generator:
-        patterns.append(pattern)
-        if count.value >= n.value:
-            with n.get_lock():
-                n.value <<= 1
-            log.info(f'Found pattern {count.value}.')
-        with count.get_lock():
-            count.value += 1
-    return patterns
+
+def is_sparse(counts, transactions, density=0.25):
+    '''check whether a pattern base fills less than `density` of its item
+    by transaction matrix; as in FP-growth*, FP-arrays are only built for
+    sparse trees, since dense ones share most prefixes and their counting
+    scans cost less than filling the array
+
+    Parameters
+    ----------
+    counts: dict{int: int}
+        Count of every item kept in the pattern base.
+
+    transactions: int
+        Number of transactions in the pattern base.
+
+    density: float = 0.25
+        Fraction of the matrix at or above which the base is dense.
+
+    Returns
+    -------
+    sparse: bool    '''
+
+    if not counts or not transactions:
+        return False
+    return sum(counts.values()) < density * len(counts) * transactions
+
+
+def find_patterns(tree, min_support, max_support, max_size, fparray=False,
+        split=0, mode='all', top=0, min_size=1, hybrid=0):
+    '''pattern finding function for a single thread
+
+    Trees with more than `split` nodes are not mined here; only their own
+    patterns are found and their conditional subtrees are handed back to
+    be scheduled as new tasks. If tree is an item rather than a tree, the
+    task first projects the master tree, inherited from the parent process,
+    onto that item.
+
+    If the worker has a pattern shard, patterns are appended to it as they
+    are found instead of being returned. With `top`, patterns of at least
+    `min_size` items raise the shared support threshold as they are found,
+    and patterns that fall below it are not returned. In closed and maximal
+    mode, candidates contained in another candidate of the task are dropped
+    before they are returned; see `Fpgrowth.filter_patterns`.
+
+    Returns
+    -------
+    patterns: list[tuple(int, list[int])]/tuple(str, int)
+        The patterns found, or the path of the shard they were written to
+        and their number.
+
+    subtrees: list[Tree/ArrayTree]
+        Conditional subtrees still left to mine.
+
+    duration: float
+        Seconds spent on the task.
+
+    nodes: int
+        Size of the tree mined by the task.
+
+    stats: dict{str: float}
+        Work of the task finished with bitsets and counting scans skipped
+        with FP-arrays; see `generate_patterns`. '''
+
+    start = time.perf_counter()
+    stats = {'branches': 0, 'patterns': 0, 'seconds': 0.0, 'scans': 0}
+    if isinstance(tree, int):
+        if master.fparray is not None:
+            stats['scans'] += 1
+        tree = master.conditional_tree(tree, min_support, max_support,
+            fparray and (max_size == 0 or max_size > 2))
+    nodes = tree.count_nodes()
+    subtrees = [] if split and nodes > split else None
+    if mode == 'all':
+        generator = Fpgrowth.generate_patterns(tree, min_support, 
+            max_support, max_size, fparray, subtrees, 
+            threshold if top else None, hybrid, stats)
+    else:
+        generator = Fpgrowth.generate_closed(tree, min_support, 
+            max_support, max_size, fparray, subtrees, stats)
+    if top:
+        patterns = []
+        for support, pattern in generator:
+            if support >= threshold.value:
+                patterns.append((support, pattern))
+                if len(pattern) >= min_size:
+                    rank(ranked, support, top)
+            progress.add()
+        patterns = [pattern for pattern in patterns 
+            if pattern[0] >= threshold.value]
+    elif shard is None:
+        patterns = []
+        for pattern in generator:
+            patterns.append(pattern)
+            progress.add()
+        if mode != 'all':
+            candidates = {frozenset(pattern): support 
+                for support, pattern in patterns}
+            patterns = [(support, sorted(pattern)) for pattern, support in
+                Fpgrowth.filter_patterns(candidates, mode).items()]
+    else:
+        found = 0
+        for support, pattern in generator:
+            shard.write(pattern, support)
+            progress.add()
+            found += 1
+        shard.flush()
+        patterns = (shard.filepath, found)
+    progress.flush()
+    duration = time.perf_counter() - start
+    return patterns, subtrees or [], duration, nodes, stats
 
 
 class Fpgrowth:
@@ -50,22 +192,78 @@ class Fpgrowth:
     support: dict{str: int}
         A dictionary mapping the names of items to their support;
         not the support here is an integer between zero and the 
-        number of transactions, not a float between 0 ad 1. '''
+        number of transactions, not a float between 0 ad 1. 
+
+    backend: str = 'object'
+        The tree implementation to build transactions into; "object" builds
+        a `Tree` of `Node` objects and "array" builds an `ArrayTree`.
+
+    Attributes
+    ----------
+    items: list[str]
+        The item dictionary; items are ranked by descending support, so
+        the index of an item in this list is its integer rank. Trees and
+        patterns hold ranks and are only decoded when written out.
 
-    def __init__(self, support):
-        self.tree = Tree()
+    ranks: dict{str: int}
+        The inverse of the item dictionary, mapping items to their rank. '''
+
+    # first cell of the row patterns csv files record their number of
+    # transactions in, ahead of every pattern
+
+    marker = '#transactions'
+
+    def __init__(self, support, backend='object'):
+        backends = {'object': Tree, 'array': ArrayTree}
+        if backend not in backends:
+            raise ValueError('Fpgrowth expected backend to be "object" or '
+                f'"array" but got "{backend}".')
+        self.tree = backends[backend]()
         self.support = support
+        self.items = sorted(support, key=lambda item: (-support[item], item))
+        self.ranks = {item: rank for rank, item in enumerate(self.items)}
+        self.partitions = None
+        self.dedupe = True
+
+
+    def __setstate__(self, state):
+        if 'items' in state:
+            self.__dict__.update(state)
+            return
+
+        # pickled before items were ranked; the tree holds item names, so
+        # the transactions of every path are inserted again by rank
+        log.info('Ranking the items of a tree pickled with item names.')
+        legacy = state['tree']
+        self.__init__(state['support'])
+        stack = [(legacy.root, [])]
+        while stack:
+            node, itemset = stack.pop()
+            own = node.count - sum(child.count 
+                for child in node.children.values())
+            if node is legacy.root:
+                own -= 1
+            if own > 0:
+                self.tree.insert_itemset(sorted(itemset), own)
+            for child in node.children.values():
+                stack.append((child, itemset + [self.ranks[child.item]]))
 
 
     @classmethod
-    def generate_patterns(self, tree, min_support=0, max_support=1, max_size=0):
-        '''recursively generates frequent patterns off of tree
+    def generate_patterns(self, tree, min_support=0, max_support=1, max_size=0,
+            fparray=False, subtrees=None, threshold=None, hybrid=0, stats=None):
+        '''generates frequent patterns off of tree
+
+        Conditional trees are mined depth first off an explicit stack of
+        (tree, remaining items) frames, so the depth of the mining is not
+        bound by the recursion limit and every pattern is yielded straight
+        from this generator rather than through a chain of nested ones.
         
         Parameters
         ----------
-        tree: Tree
-            The tree to read patterns from; this function will continue to
-            recursively itself with subtrees until the tree is a path or empty.
+        tree: Tree/ArrayTree
+            The tree to read patterns from; subtrees are projected off of it
+            until they are paths, empty or can no longer grow.
 
         min_support: int
             The minimum support of a pattern for it to be included in the
@@ -75,76 +273,377 @@ class Fpgrowth:
 
         max_size: int
 
+        fparray: bool = False
+            Record an FP-array of item pair counts on every conditional tree
+            that will be projected again, so projecting it can skip its
+            counting scan.
+
+        subtrees: list = None
+            If a list is given, only the patterns of tree itself are yielded
+            and its conditional subtrees are appended to the list, unmined.
+
+        threshold: multiprocessing.Value = None
+            A support threshold that may be raised while mining, as in top-k
+            mode; patterns and items below it are skipped as soon as it is.
+
+        hybrid: int = 0
+            Number of transactions at or below which a conditional tree that
+            is not a path is turned into bitsets and finished with
+            intersections (see `generate_bitsets`); 0 never switches.
+
+        stats: dict{str: float} = None
+            If given, the number of "branches" finished with bitsets, the
+            "patterns" they yielded and the "seconds" spent on them are added
+            to it, as are the counting "scans" of conditional trees skipped
+            by reading their parent's FP-array.
 
         Yields
         ------
-        pattern: tuple(float, list[str])    '''
-
-        items = tree.nodes.keys()
-        if tree.is_path():
-            size_remain = len(items) + 1
-            if max_size:
-                size_remain = max_size - len(tree.items) + 1
-            for i in range(1, size_remain):
-                for itemset in combinations(items, i):
-                    support = min([tree.nodes[i][0].count for i in itemset])
-                    yield support, tree.items + list(itemset)
-        elif max_size == 0  or max_size > len(tree.items):            
-            for item in items:
-                support = sum([node.count for node in tree.nodes[item]])
-                yield support, tree.items + [item]
-                
-            for item in items:
-                subtree = tree.conditional_tree(item, min_support, max_support)
-                for support, itemset in self.generate_patterns(subtree, 
-                        min_support, max_support, max_size):
-                    yield support, itemset
+        pattern: tuple(float, list[int])    '''
+
+        def floor():
+            if threshold is None:
+                return min_support
+            return max(min_support, threshold.value)
+
+        def frequent(items, counts):
+            return (item for item in items if counts[item] >= floor())
+
+        stack = []
+        while tree is not None:
+            items = tree.header()
+            if threshold is not None:
+                counts = {item: tree.support(item) for item in items}
+                items = [item for item in items if counts[item] >= floor()]
+            if (hybrid and tree.count_transactions() <= hybrid 
+                    and not tree.is_path()):
+                start = time.perf_counter()
+                found = 0
+                for pattern in self.generate_bitsets(tree, min_support,
+                        max_support, max_size):
+                    found += 1
+                    yield pattern
+                if stats is not None:
+                    stats['branches'] += 1
+                    stats['patterns'] += found
+                    stats['seconds'] += time.perf_counter() - start
+            elif tree.is_path():
+                size_remain = len(items) + 1
+                if max_size:
+                    size_remain = max_size - len(tree.items) + 1
+                support = {item: tree.support(item) for item in items}
+                for i in range(1, size_remain):
+                    for itemset in combinations(items, i):
+                        yield (min([support[i] for i in itemset]), 
+                            tree.items + list(itemset))
+            elif max_size == 0  or max_size > len(tree.items):            
+                for item in items:
+                    support = tree.support(item)
+                    yield support, tree.items + [item]
+
+                # subtrees are only projected if they can still grow
+
+                if max_size == 0 or max_size > len(tree.items) + 1:
+                    remaining = iter(items)
+                    if threshold is not None:
+                        remaining = frequent(items, counts)
+                    if subtrees is None:
+                        stack.append((tree, remaining))
+                    else:
+                        grow = fparray and (max_size == 0 or 
+                            max_size > len(tree.items) + 2)
+                        projected = len(subtrees)
+                        subtrees.extend(tree.conditional_tree(item, floor(),
+                            max_support, grow) for item in remaining)
+                        if stats is not None and tree.fparray is not None:
+                            stats['scans'] += len(subtrees) - projected
+
+            tree = None
+            while stack and tree is None:
+                parent, remaining = stack[-1]
+                item = next(remaining, None)
+                if item is None:
+                    stack.pop()
+                else:
+                    if stats is not None and parent.fparray is not None:
+                        stats['scans'] += 1
+                    tree = parent.conditional_tree(item, floor(), 
+                        max_support, fparray and (max_size == 0 or 
+                        max_size > len(parent.items) + 2))
+
+
+    @classmethod
+    def generate_bitsets(self, tree, min_support=0, max_support=1, 
+            max_size=0):
+        '''generates frequent patterns off of tree with bitset intersections
+
+        Each transaction of the tree becomes a bit and each item a packed
+        bit array of the transactions it is in, which are then mined as
+        `Eclat` does; this costs far less per pattern than projecting the
+        many small conditional trees deep down a branch. Patterns are the
+        same as those `generate_patterns` finds off the tree.
+
+        Parameters
+        ----------
+        tree: Tree/ArrayTree
+            The tree to read patterns from; every transaction of it takes a
+            bit, so it should be small.
+
+        min_support: int
+
+        max_support: int
+
+        max_size: int
+
+        Yields
+        ------
+        pattern: tuple(float, list[int])    '''
+
+        # eclat builds on this module, so it can only be imported here
+
+        from knowledge.struct.eclat import Eclat
+
+        items = sorted(tree.header())
+        if max_size and len(tree.items) >= max_size:
+            return
+        index = {item: idx for idx, item in enumerate(items)}
+        matrix = np.zeros((len(items), tree.count_transactions()), dtype=bool)
+        column = 0
+        for path, count in tree.paths():
+            matrix[[index[item] for item in path], column:column + count] = True
+            column += count
+        bitsets = np.packbits(matrix, axis=1, bitorder='little')
+        supports = [tree.support(item) for item in items]
+
+        for item, support in zip(items, supports):
+            yield support, tree.items + [item]
+        if max_size and len(tree.items) + 1 >= max_size:
+            return
+
+        size = max_size - len(tree.items) if max_size else 0
+        for head in range(1, len(items)):
+            for support, pattern in Eclat.generate_patterns(bitsets, head,
+                    range(head - 1, -1, -1), supports, max(min_support, 1), 
+                    max_support, size):
+                yield support, tree.items + [items[idx] for idx in pattern]
+
+
+    @classmethod
+    def generate_closed(self, tree, min_support=0, max_support=1, max_size=0,
+            fparray=False, subtrees=None, stats=None):
+        '''generates candidate closed patterns off of tree
+
+        Items found in every transaction of a conditional tree (its closure)
+        are merged into its prefix instead of being projected on, so the
+        subsets a prefix shares its support with are never enumerated; a
+        path only yields its prefixes where the support drops. Closures are
+        carried down to conditional trees in `closure`, so every frequent
+        pattern of at most max_size items ends up in a yielded pattern with
+        the same support, though yielded patterns may be larger. Items ranked
+        after the last item of the prefix are not in the tree, so some
+        candidates are not closed; each task drops those contained in its own
+        candidates and `filter_patterns` removes the rest once the candidates
+        of every task are gathered.
+
+        Parameters
+        ----------
+        tree: Tree/ArrayTree
+            The tree to read patterns from; the count of its root is the
+            support of its prefix.
+
+        min_support: int
+
+        max_support: int
+
+        max_size: int
+            Number of items projected on beyond which trees are not grown.
+
+        fparray: bool = False
+            Record an FP-array on every conditional tree.
+
+        subtrees: list = None
+            If a list is given, only the patterns of tree itself are yielded
+            and its conditional subtrees are appended to the list, unmined.
+
+        stats: dict{str: float} = None
+            If given, the counting "scans" skipped by reading FP-arrays are
+            added to it.
+
+        Yields
+        ------
+        pattern: tuple(float, list[int])    '''
+
+        def project(parent, closure, item):
+            if stats is not None and parent.fparray is not None:
+                stats['scans'] += 1
+            child = parent.conditional_tree(item, min_support, max_support,
+                fparray)
+            child.closure = parent.closure + [other for other in closure
+                if other > item]
+            return child
+
+        stack = []
+        while tree is not None:
+            support = tree.count_transactions()
+            counts = {item: tree.support(item) for item in tree.header()}
+            closure = [item for item in counts if counts[item] == support]
+            prefix = tree.items + tree.closure + closure
+            items = [item for item in counts if counts[item] < support]
+            if prefix:
+                yield support, prefix
+
+            if not items or max_size and len(tree.items) >= max_size:
+                pass
+            elif tree.is_path():
+                items.sort(key=lambda item: counts[item], reverse=True)
+                for idx, item in enumerate(items):
+                    last = idx + 1 == len(items)
+                    if last or counts[items[idx + 1]] < counts[item]:
+                        yield counts[item], prefix + items[:idx + 1]
+            elif subtrees is None:
+                stack.append((tree, closure, iter(items)))
+            else:
+                subtrees.extend(project(tree, closure, item) for item in items)
+
+            tree = None
+            while stack and tree is None:
+                parent, closure, remaining = stack[-1]
+                item = next(remaining, None)
+                if item is None:
+                    stack.pop()
+                else:
+                    tree = project(parent, closure, item)
+
+
+    @classmethod
+    def filter_patterns(self, patterns, mode='closed'):
+        '''filter candidate patterns down to closed or maximal ones
+
+        Candidates are checked from the largest down against the patterns
+        kept so far, within their support in closed mode. The kept patterns
+        holding an item are a bitset over the kept patterns, so checking a
+        candidate takes one AND per item of it, stopping at the first empty
+        one, rather than a pass over other patterns. Tasks filter their own
+        candidates likewise before sending them back.
+
+        Parameters
+        ----------
+        patterns: dict{frozenset[int]: int}
+            Candidate patterns, as found by `find_patterns`.
+
+        mode: str = 'closed'
+            Either "closed", to drop patterns contained in another pattern
+            with the same support, or "maximal", to drop patterns contained
+            in any other pattern.
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}  '''
+
+        # a pattern is only contained in larger ones, and in closed mode in
+        # ones of the same support, so those are kept before it is checked
+
+        groups = defaultdict(lambda: [defaultdict(int), 0])
+        kept = set()
+        for pattern, support in sorted(patterns.items(), 
+                key=lambda entry: len(entry[0]), reverse=True):
+            group = groups[support if mode == 'closed' else None]
+            postings = group[0]
+            found = -1
+            for item in pattern:
+                found &= postings[item]
+                if not found:
+                    break
+            if found:
+                continue
+            kept.add(pattern)
+            bit = 1 << group[1]
+            group[1] += 1
+            for item in pattern:
+                postings[item] |= bit
+
+        return {pattern: support for pattern, support in patterns.items()
+            if pattern in kept}
 
         
     @classmethod
-    def calculate_support(self, filepath):
-        csvfile = multiopen(filepath, mode='r')
-        csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+    def calculate_support(self, filepath, fmt='auto', chunksize=65536):
+        '''count the support of every item in a transactions file
+
+        A dense indicator matrix is read in blocks of `chunksize` rows and
+        summed column-wise with numpy, so memory stays bounded by the block;
+        a sparse item list file is streamed one transaction at a time.
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions csv file; gzipped if it ends with ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse" or "csr" for a binary
+            `TransactionStore`; "auto" detects it from the header (see
+            `Transaction.detect_format`).
+
+        chunksize: int = 65536
+            Number of dense transactions to parse and sum at a time.
+
+        Returns
+        -------
+        support: dict{str: int}
+            Dictionary mapping every item to its support.   '''
+
         count = 0
         n = 1
 
-        _, *items = next(csvreader)
-        support = [0]*len(items)
-        for transaction in csvreader:
-            for item, cond in enumerate(transaction[1:]):
-                if int(cond):
+        if fmt == 'auto':
+            fmt = Transaction.detect_format(filepath)
+
+        if fmt == 'csr':
+            store = TransactionStore(filepath)
+            count = len(store)
+            support = dict(zip(store.items, store.support.tolist()))
+        elif fmt == 'dense':
+            _, *items = Transaction.read_header(filepath)
+            support = np.zeros(len(items), dtype=np.uint64)
+            for block in Transaction.dense_blocks(filepath, chunksize):
+                support += block.sum(axis=0, dtype=np.uint64)
+                count += len(block)
+                if count >= n:
+                    log.info(f'Processed transaction {count}.')
+                    while n <= count:
+                        n <<= 1
+            support = dict(zip(items, support.tolist()))
+        else:
+            support = defaultdict(int)
+            for itemset in Transaction.itemsets(filepath, fmt):
+                for item in itemset:
                     support[item] += 1
                 count += 1
                 if count == n:
-                    log.info(f'Processed code {count}.')
+                    log.info(f'Processed transaction {count}.')
                     n <<= 1
-        support = dict(zip(items, support))
-
-        # alterate file format
+            support = dict(support)
 
-        # support = defaultdict(int)
-        # for transaction in csvreader:
-        #     for code in transaction:
-        #         support[code] += 1
-        #         count += 1
-        #         if count == n:
-        #             log.info(f'Processed code {count}.')
-        #             n <<= 1
-
-        if count != n >> 1:
-            log.info(f'Processed code {count}.')
-        csvfile.close()
+        log.info(f'Counted support of {len(support)} items over {count} '
+            'transactions.')
 
         return support
 
     
     @classmethod
     def load_patterns(self, filepath):
-        csvfile = multiopen(filepath, mode='r')
+        if PatternStore.is_store(filepath):
+            store = PatternStore(filepath)
+            return {frozenset(store.items[rank] for rank in pattern): support
+                for pattern, support in store.patterns()}
+
+        csvfile = multiopen(filepath, mode='rt')
         csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
         patterns = {}
 
         for row in csvreader:
+            if row[0] == self.marker:
+                continue
             patterns[frozenset(row[:-1])] = int(row[-1])
 
         csvfile.close()
@@ -152,54 +651,790 @@ class Fpgrowth:
 
 
     @classmethod
-    def write_patterns(self, patterns, filepath):
-        csvfile = multiopen(filepath, mode='w')
+    def read_transactions(self, filepath):
+        '''number of transactions the patterns of a csv file or pattern store
+        were found in
+
+        Returns
+        -------
+        transactions: int
+            The recorded number, or None if it was not written with the
+            patterns.   '''
+
+        if PatternStore.is_store(filepath):
+            return PatternStore(filepath).transactions
+
+        with multiopen(filepath, mode='rt') as csvfile:
+            row = next(csv.reader(csvfile, delimiter=',', quotechar='"'), None)
+        if row and row[0] == self.marker:
+            return int(row[1])
+        return None
+
+
+    @classmethod
+    def write_patterns(self, patterns, filepath, items=None, fmt='csv',
+            transactions=None):
+        '''write patterns to a csv file or a pattern store
+
+        Parameters
+        ----------
+        patterns: dict{frozenset[int]: int}
+            Dictionary of patterns as returned by `find_patterns`.
+
+        filepath: str
+            Path of the file to write; gzipped if it ends with ".gz".
+
+        items: list[str] = None
+            The item dictionary used to decode item ranks back to their
+            names; if None, patterns are written as is. Required by a
+            pattern store.
+
+        fmt: str = 'csv'
+            Write a csv file, or a pattern store (see `PatternStore`) if
+            "binary".
+
+        transactions: int = None
+            Number of transactions the patterns were found in, recorded
+            with them for `read_transactions`; a csv file gets a first row
+            of `marker` and the number.   '''
+
+        if fmt == 'binary':
+            PatternStore.write(filepath, patterns.items(), items, 
+                transactions)
+            return
+
+        csvfile = multiopen(filepath, mode='wt')
         csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"')
+        if transactions is not None:
+            csvwriter.writerow((self.marker, transactions))
 
         for codes, support in patterns.items():
+            if items is not None:
+                codes = [items[code] for code in sorted(codes)]
             csvwriter.writerow((*codes, support))
 
         csvfile.close()
 
 
-    def load_transactions(self, filepath):
-        csvfile = multiopen(filepath, mode='r')
-        csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+    @classmethod
+    def merge_patterns(self, shards, filepath, items=None, clean=True,
+            fmt='csv', transactions=None):
+        '''concatenate pattern shards into a single patterns csv file, or a
+        pattern store
+
+        Shards are read one row at a time, so merging needs no more memory
+        than a row regardless of how many patterns were found.
+
+        Parameters
+        ----------
+        shards: dict{str: int}
+            Paths of the shards to merge and their number of patterns, as
+            returned by `find_patterns`.
+
+        filepath: str
+            Path of the csv file to write; gzipped if it ends with ".gz".
+
+        items: list[str] = None
+            The item dictionary used to decode item ranks back to their
+            names; if None, patterns are written as is.
+
+        clean: bool = True
+            Remove every shard once it is merged.
+
+        fmt: str = 'csv'
+            Write a csv file, or a pattern store (see `PatternStore`) if
+            "binary"; a store needs the item dictionary and holds every
+            pattern in compact arrays until it is written.
+
+        transactions: int = None
+            Number of transactions the patterns were found in; see
+            `write_patterns`.   '''
+
+        if fmt == 'binary':
+            def rows():
+                for shardpath in shards:
+                    with open(shardpath, 'r', newline='') as data:
+                        for *codes, support in csv.reader(data):
+                            yield map(int, codes), support
+            PatternStore.write(filepath, rows(), items, transactions)
+            if clean:
+                for shardpath in shards:
+                    os.remove(shardpath)
+            log.info(f'Merged {sum(shards.values())} patterns from '
+                f'{len(shards)} shards into {filepath}.')
+            return
+
+        csvfile = multiopen(filepath, mode='wt')
+        csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"')
+        if transactions is not None:
+            csvwriter.writerow((self.marker, transactions))
+
+        for shardpath in shards:
+            with open(shardpath, 'r', newline='') as data:
+                for *codes, support in csv.reader(data):
+                    if items is not None:
+                        codes = [items[int(code)] for code in codes]
+                    csvwriter.writerow((*codes, support))
+            if clean:
+                os.remove(shardpath)
+
+        csvfile.close()
+        log.info(f'Merged {sum(shards.values())} patterns from {len(shards)} '
+            f'shards into {filepath}.')
+
+
+    @classmethod
+    def apply_delta(self, filepath, delta, items=None, transactions=None):
+        '''apply a pattern delta to a patterns csv file or pattern store
+
+        Rows are streamed into a new file that replaces the old one: rows of
+        changed patterns get their new support, removed ones are skipped,
+        and added patterns are written at the end.
+
+        Parameters
+        ----------
+        filepath: str
+            Path of the patterns csv file or pattern store; gzipped if it
+            ends with ".gz".
+
+        delta: dict{frozenset[int]: int}
+            Patterns added or with a changed support, and removed patterns
+            with a support of zero, as returned by `update_patterns`.
+
+        items: list[str] = None
+            The item dictionary used to decode item ranks back to their
+            names; if None, patterns are matched and written as is.
+
+        transactions: int = None
+            Number of transactions the updated patterns were found in; if
+            None, the number recorded with the old patterns is kept.  '''
+
+        directory, name = os.path.split(filepath)
+        temppath = os.path.join(directory, f'tmp-{name}')
+
+        if PatternStore.is_store(filepath):
+            store = PatternStore(filepath)
+            items = store.items if items is None else items
+            ranks = {item: rank for rank, item in enumerate(items)}
+            lookup = [ranks[item] for item in store.items]
+            delta = dict(delta)
+            def rows():
+                for pattern, support in store.patterns():
+                    pattern = frozenset(lookup[rank] for rank in pattern)
+                    support = delta.pop(pattern, support)
+                    if support:
+                        yield pattern, support
+                for pattern, support in delta.items():
+                    if support:
+                        yield pattern, support
+            PatternStore.write(temppath, rows(), items, 
+                transactions or store.transactions)
+            os.replace(temppath, filepath)
+            log.info(f'Applied delta to {filepath}, which now has '
+                f'{len(PatternStore(filepath))} patterns.')
+            return
+
+        if items is not None:
+            delta = {frozenset(items[code] for code in codes): (support, 
+                [items[code] for code in sorted(codes)]) 
+                for codes, support in delta.items()}
+        else:
+            delta = {codes: (support, list(codes)) 
+                for codes, support in delta.items()}
+
+        source = multiopen(filepath, mode='rt')
+        target = multiopen(temppath, mode='wt')
+        csvwriter = csv.writer(target, delimiter=',', quotechar='"')
+        if transactions is not None:
+            csvwriter.writerow((self.marker, transactions))
+        kept = 0
+        for *codes, support in csv.reader(source, delimiter=',', 
+                quotechar='"'):
+            if codes == [self.marker]:
+                if transactions is None:
+                    csvwriter.writerow((*codes, support))
+                continue
+            pattern = frozenset(codes)
+            if pattern in delta:
+                support, _ = delta.pop(pattern)
+                if not support:
+                    continue
+            csvwriter.writerow((*codes, support))
+            kept += 1
+        for support, codes in delta.values():
+            if support:
+                csvwriter.writerow((*codes, support))
+                kept += 1
+        source.close()
+        target.close()
+        os.replace(temppath, filepath)
+        log.info(f'Applied delta to {filepath}, which now has {kept} '
+            'patterns.')
+
+
+    def encode_transactions(self, filepath, fmt='auto', chunksize=65536):
+        '''stream the transactions of a file as sorted lists of item ranks;
+        items missing from the item dictionary are dropped
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions csv file; gzipped if it ends with ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        chunksize: int = 65536
+            Number of dense or csr transactions to decode at a time.
+
+        Yields
+        ------
+        itemset: list[int]  '''
+
+        if fmt == 'auto':
+            fmt = Transaction.detect_format(filepath)
+
+        if fmt == 'csr':
+            store = TransactionStore(filepath)
+            lookup = np.array([self.ranks.get(item, -1) for item in store.items],
+                dtype=np.int64)
+            for indptr, indices in store.blocks(chunksize):
+                rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+                yield from split_rows(rows, lookup[indices], len(indptr) - 1)
+        elif fmt == 'dense':
+            _, *items = Transaction.read_header(filepath)
+            lookup = np.array([self.ranks.get(item, -1) for item in items],
+                dtype=np.int64)
+            for block in Transaction.dense_blocks(filepath, chunksize):
+                rows, cols = np.nonzero(block)
+                yield from split_rows(rows, lookup[cols], len(block))
+        else:
+            ranks = self.ranks
+            for itemset in Transaction.itemsets(filepath, fmt):
+                yield sorted(ranks[item] for item in itemset if item in ranks)
+
+
+    def load_transactions(self, filepath, fmt='auto', chunksize=65536, 
+            dedupe=True):
+        '''stream a dense or sparse transactions file into the tree
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions csv file; gzipped if it ends with ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        chunksize: int = 65536
+            Number of dense or csr transactions to decode, and of itemsets
+            to deduplicate, at a time.
+
+        dedupe: bool = True
+            Count identical itemsets of every block first and insert each
+            distinct itemset once, weighted by its multiplicity; otherwise
+            every transaction is inserted as it is read. '''
+
+        self.insert_itemsets(self.encode_transactions(filepath, fmt, 
+            chunksize), dedupe=dedupe, chunksize=chunksize)
+
+
+    def insert_itemsets(self, itemsets, tree=None, dedupe=True, 
+            chunksize=65536):
+        '''insert a stream of rank sorted itemsets into a tree
+
+        Parameters
+        ----------
+        itemsets: iterable[list[int]]
+
+        tree: Tree/ArrayTree = None
+            The tree to insert into; default is the tree of this instance.
+
+        dedupe: bool = True
+            Count identical itemsets first and insert each distinct itemset
+            once, weighted by its multiplicity.
+
+        chunksize: int = 65536
+            Number of itemsets deduplicated at a time; the counts of every
+            block are inserted before the next block is read, so mostly
+            unique itemsets are never all held besides the tree.
+
+        Returns
+        -------
+        count: int
+            Number of itemsets inserted. '''
+
+        tree = self.tree if tree is None else tree
         count = 0
+        inserted = 0
         n = 1
+        distinct = defaultdict(int)
+
+        def flush():
+            nonlocal inserted
+            for itemset, weight in distinct.items():
+                tree.insert_itemset(itemset, weight)
+            inserted += len(distinct)
+            distinct.clear()
         
-        _, *items = next(csvreader)
-        for transaction in csvreader:
-            itemset = [item for cond, item in zip(transaction[1:], items) 
-                if int(cond) and item in self.support]
-            itemset.sort(key=self.support.get, reverse=True)
-            self.tree.insert_itemset(itemset)
+        for itemset in itemsets:
+            if dedupe:
+                distinct[tuple(itemset)] += 1
+            else:
+                tree.insert_itemset(itemset)
             count += 1
             if count == n:
                 log.info(f'Processed transaction {count}.')
                 n <<= 1
+            if count % chunksize == 0:
+                flush()
+
+        if count != n >> 1:
+            log.info(f'Processed transaction {count}.')
+
+        if dedupe:
+            flush()
+            ratio = count / inserted if inserted else 1
+            log.info(f'Inserted {inserted} distinct itemsets for {count} '
+                f'transactions; {ratio:.2f}x compression.')
+
+        return count
+
+
+    def partition_transactions(self, filepath, directory, fmt='auto', 
+            cap=268435456, chunksize=65536, dedupe=True):
+        '''stream a transactions file into item group partitions on disk
+        rather than into the tree (parallel FP-growth)
+
+        Items are split into groups of consecutive ranks. Every transaction
+        is written to the partition of each group it has items of, cut
+        after its last item of the group; that keeps the prefix paths of
+        every item of the group, so the tree built from a partition projects
+        onto the same conditional trees as the full tree for those items.
+        Partitions are then built into trees and mined one at a time by
+        `find_patterns`, with the same results as mining the full tree.
+
+        There are as many groups as `cap` fits into the item occurrences of
+        the file, balanced by the support of their items times their rank,
+        which bounds the length of their prefixes; a partition that still
+        ends up with more than `cap` item occurrences is split in two and
+        projected again.
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions csv file; gzipped if it ends with ".gz".
+
+        directory: str
+            Directory to write the partitions to.
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        cap: int = 268435456
+            Maximum number of item occurrences in a partition; a partition
+            of a single item may exceed it.
+
+        chunksize: int = 65536
+            Number of dense or csr transactions to decode at a time.
+
+        dedupe: bool = True
+            Deduplicate itemsets when building the tree of a partition; see
+            `load_transactions`.   '''
+
+        os.makedirs(directory, exist_ok=True)
+        self.dedupe = dedupe
+        total = sum(self.support.values())
+        groups = self.group_items(list(range(len(self.items))), 
+            max(-(-total // cap), 1))
+        log.info(f'Projecting transactions onto {len(groups)} item groups.')
+        pending = self.project_partitions(self.encode_transactions(filepath,
+            fmt, chunksize), groups, directory)
+        
+        self.partitions = []
+        while pending:
+            partition = pending.pop()
+            if partition.occurrences <= cap or len(partition.items) == 1:
+                if partition.occurrences > cap:
+                    log.warning(f'Partition of item {partition.items[0]} has '
+                        f'{partition.occurrences} item occurrences, over the '
+                        f'cap of {cap}; it cannot be split further.')
+                self.partitions.append(partition)
+                continue
+            log.info(f'Splitting partition of {len(partition.items)} items '
+                f'with {partition.occurrences} item occurrences.')
+            pending.extend(self.project_partitions(
+                partition.itemsets(chunksize), 
+                self.group_items(partition.items, 2), directory,
+                partition.transactions))
+            partition.remove()
+        self.partitions.sort(key=lambda partition: partition.items[0])
+
+        occurrences = sum(partition.occurrences 
+            for partition in self.partitions)
+        log.info(f'Partitioned transactions into {len(self.partitions)} '
+            f'partitions with {occurrences} item occurrences in {directory}.')
+
+
+    def group_items(self, items, count):
+        '''split items into at most count groups of consecutive ranks with
+        about the same sum of support times rank; an item starts a new group
+        once its middle is past the share of the current group'''
+
+        weights = [self.support[self.items[item]] * (item + 1) 
+            for item in items]
+        total = sum(weights)
+        groups = [[]]
+        weight = 0
+        for item, cost in zip(items, weights):
+            if groups[-1] and weight + cost / 2 > total * len(groups) / count:
+                groups.append([])
+            groups[-1].append(item)
+            weight += cost
+        return groups
+
+
+    def project_partitions(self, itemsets, groups, directory, 
+            transactions=None):
+        '''write every itemset to the partition of each item group it has
+        items of, cut after its last item of the group
+
+        Parameters
+        ----------
+        itemsets: iterable[list[int]]
+            Rank sorted itemsets to project.
+
+        groups: list[list[int]]
+            Groups of item ranks, one partition each.
+
+        directory: str
+            Directory to write the partitions to.
+
+        transactions: int = None
+            Number of transactions the itemsets stand for; default is None,
+            which counts the itemsets.
+
+        Returns
+        -------
+        partitions: list[TransactionPartition]  '''
+
+        lookup = [-1] * len(self.items)
+        for idx, group in enumerate(groups):
+            for item in group:
+                lookup[item] = idx
+        partitions = [TransactionPartition(os.path.join(directory, 
+            f'partition-{group[0]}-{group[-1]}'), group) for group in groups]
+        count = 0
+        n = 1
+
+        for itemset in itemsets:
+            seen = set()
+            for idx in range(len(itemset) - 1, -1, -1):
+                group = lookup[itemset[idx]]
+                if group >= 0 and group not in seen:
+                    seen.add(group)
+                    partitions[group].append(itemset[:idx + 1])
+            count += 1
+            if transactions is None and count == n:
+                log.info(f'Processed transaction {count}.')
+                n <<= 1
+
+        if transactions is None and count != n >> 1:
+            log.info(f'Processed transaction {count}.')
+
+        for partition in partitions:
+            partition.flush()
+            partition.transactions = count if transactions is None else \
+                transactions
+        return partitions
+
+
+    def find_partitions(self, min_support=0, max_support=1, max_size=0, 
+            cores=None, shards=None, mode='all', **kwargs):
+        '''finds patterns from the transaction partitions, building and
+        mining the tree of one partition at a time; see 
+        `partition_transactions`
+
+        Every partition is mined for the patterns whose least frequent item
+        is in its group, so their union is every pattern. Closed and maximal
+        candidates are filtered again once every partition is mined, since
+        a pattern can be contained in one found from another partition.
+        
+        Parameters are those of `find_patterns`; patterns are streamed into
+        a subdirectory of `shards` for every partition.    '''
+
+        patterns = {}
+        for idx, partition in enumerate(self.partitions):
+            log.info(f'Building tree of partition {idx + 1} of '
+                f'{len(self.partitions)} with {len(partition.items)} items '
+                f'over {partition.rows} transactions.')
+            tree = type(self.tree)()
+            self.insert_itemsets(partition.itemsets(), tree, 
+                getattr(self, 'dedupe', True))
+            tree.insert_itemset([], partition.transactions - partition.rows)
+            directory = None
+            if shards is not None:
+                directory = os.path.join(shards, 
+                    os.path.basename(partition.filepath))
+            patterns.update(self.find_patterns(tree, min_support, 
+                max_support, max_size, cores, shards=directory, mode=mode,
+                heads=partition.items, **kwargs))
+            tree = None
+
+        if mode != 'all':
+            found = len(patterns)
+            patterns = self.filter_patterns(patterns, mode)
+            log.info(f'Kept {len(patterns)} {mode} patterns of {found} '
+                'candidates across partitions.')
+
+        return patterns
+
+
+    def insert_transactions(self, filepath, fmt='auto', chunksize=65536,
+            dedupe=True):
+        '''stream newly appended transactions into the existing tree
+
+        Items not seen before are ranked after every known item, by
+        descending support, so the tree stays ordered by rank; known items
+        keep their rank even where the new transactions change their order
+        of support. Any frequent pattern array of the tree is dropped.
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the file of new transactions; gzipped if it ends with 
+            ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        chunksize: int = 65536
+
+        dedupe: bool = True
+            Deduplicate itemsets before inserting them; see 
+            `load_transactions`.
+
+        Returns
+        -------
+        added: dict{int: int}
+            The support every item of the new transactions gained, by rank.
+        '''
+
+        support = self.calculate_support(filepath, fmt, chunksize)
+        unseen = sorted((item for item in support if item not in self.ranks),
+            key=lambda item: (-support[item], item))
+        for item in unseen:
+            self.ranks[item] = len(self.items)
+            self.items.append(item)
+            self.support[item] = 0
+        for item, count in support.items():
+            self.support[item] += count
+        self.tree.fparray = None
+
+        self.insert_itemsets(self.encode_transactions(filepath, fmt, 
+            chunksize), dedupe=dedupe, chunksize=chunksize)
+        log.info(f'Inserted transactions with {len(support)} items, '
+            f'{len(unseen)} of which are new.')
+
+        return {self.ranks[item]: count for item, count in support.items() 
+            if count}
+
+
+    def update_patterns(self, patterns, added, transactions, min_support=0,
+            max_support=1, max_size=0, cores=None, **kwargs):
+        '''update the patterns found before transactions were inserted with
+        `insert_transactions`
+
+        Only patterns contained in a new transaction gain support, and their
+        least frequent item is one of the items of the new transactions, so
+        only the conditional trees of those items are mined again. Every
+        other pattern keeps its support and is only dropped if it falls
+        below the minimum support, which rises with the number of
+        transactions. Patterns over a maximum support below one were never
+        kept and may come within it, so then every item is mined again.
+
+        Parameters
+        ----------
+        patterns: dict{frozenset[int]: int}
+            The patterns found before the insert, as sets of item ranks.
+
+        added: dict{int: int}
+            The support gained by every item, as returned by 
+            `insert_transactions`.
+
+        transactions: int
+            Number of transactions the patterns were found from.
+
+        min_support: float
+
+        max_support: float
+
+        max_size: int
+
+        cores: int/None
+
+        **kwargs
+            The options of `find_patterns` to find all patterns with.
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            The updated patterns.
+
+        delta: dict{frozenset[int]: int}
+            Patterns added or with a changed support, and removed patterns
+            with a support of zero.  '''
+
+        total = self.tree.count_transactions()
+        before = min_support * transactions
+        after = min_support * total
+        rose = 0
+        fell = 0
+        for rank, item in enumerate(self.items):
+            support = self.support[item]
+            previous = support - added.get(rank, 0)
+            if previous < before and support >= after:
+                rose += 1
+            elif previous >= before and support < after:
+                fell += 1
+        log.info(f'{rose} items rose to and {fell} items fell below the '
+            f'minimum support over {total - transactions} new transactions.')
+
+        heads = set(added)
+        if max_support < 1:
+            log.info('Mining every item again since patterns over the '
+                'maximum support were not kept.')
+            heads = set(range(len(self.items)))
+        log.info(f'Mining {len(heads)} of {len(self.items)} items again.')
+        updated = {pattern: support for pattern, support in patterns.items()
+            if max(pattern) not in heads and 
+                (len(pattern) == 1 or support >= after)}
+        updated.update(self.find_patterns(None, min_support, max_support,
+            max_size, cores, heads=heads, **kwargs))
+
+        delta = {pattern: support for pattern, support in updated.items()
+            if patterns.get(pattern) != support}
+        changed = sum(1 for pattern in delta if pattern in patterns)
+        removed = 0
+        for pattern in patterns:
+            if pattern not in updated:
+                delta[pattern] = 0
+                removed += 1
+        log.info(f'Pattern delta has {len(delta) - changed - removed} added, '
+            f'{changed} changed and {removed} removed patterns.')
+
+        return updated, delta
+
+
+    def find_pairs(self, filepath, fmt='auto', min_support=0, max_support=1,
+            chunksize=65536):
+        '''find every pattern of at most two items straight from a
+        transactions file, without building the tree
+
+        Every block of `chunksize` transactions is encoded as a sparse
+        (transactions, items) indicator matrix X, and the co-occurrence
+        counts of all item pairs are accumulated at once as XᵀX; memory is
+        bounded by the block and the number of pairs that occur together.
+        The diagonal holds the support of every item.
+
+        Finds the same patterns as `find_patterns` with a `max_size` of 2.
+        The number of transactions read is kept in `transactions`.
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions csv file; gzipped if it ends with ".gz".
 
-        # alternate file format
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
 
-        # for transaction in csvreader:
-        #     self.tree.insert_itemset(transaction)
-        #     count += 1
-        #     if count == n:
-        #         log.info(f'Processed transaction {count}.')
-        #         n <<= 1
+        min_support: float
 
+        max_support: float
+
+        chunksize: int = 65536
+            Number of transactions to multiply at a time.
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            A dictionary mapping patterns, as sets of item ranks, to their
+            support; decode ranks with `items`. '''
+
+        size = len(self.items)
+        counts = sparse.csr_matrix((size, size), dtype=np.int64)
+        lengths = []
+        indices = []
+        count = 0
+        n = 1
+
+        def multiply():
+            indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            block = sparse.csr_matrix((np.ones(len(indices), dtype=np.int64),
+                indices, indptr), shape=(len(lengths), size))
+            return block.T @ block
+
+        for itemset in self.encode_transactions(filepath, fmt, chunksize):
+            lengths.append(len(itemset))
+            indices.extend(itemset)
+            count += 1
+            if len(lengths) == chunksize:
+                counts += multiply()
+                lengths = []
+                indices = []
+            if count == n:
+                log.info(f'Processed transaction {count}.')
+                n <<= 1
+
+        if lengths:
+            counts += multiply()
         if count != n >> 1:
             log.info(f'Processed transaction {count}.')
-        csvfile.close()
+
+        self.transactions = count
+        min_support = min_support * count
+        max_support = max_support * count
+        support = counts.diagonal()
+        patterns = {frozenset((item,)): support 
+            for item, support in enumerate(support.tolist()) if support}
+
+        # every pair is counted twice, once on either side of the diagonal
+
+        pairs = sparse.triu(counts, k=1).tocoo()
+        keep = (pairs.data >= min_support) & (pairs.data <= max_support)
+        for first, second, support in zip(pairs.row[keep].tolist(), 
+                pairs.col[keep].tolist(), pairs.data[keep].tolist()):
+            patterns[frozenset((first, second))] = support
+
+        log.info(f'Found {len(patterns)} patterns from the co-occurrence '
+            f'counts of {pairs.nnz} item pairs.')
+
+        return patterns
 
 
     def find_patterns(self, tree=None, min_support=0, max_support=1, 
-            max_size=0, cores=None):
+            max_size=0, cores=None, fparray=False, split=None, share=False,
+            interval=60, shards=None, mode='all', top=0, min_size=1,
+            hybrid=0, heads=None):
         '''finds patterns from tree using multiprocessing
 
+        Every conditional subtree of the root is a task; tasks are handed to
+        idle workers one at a time, largest first. A task whose tree has
+        more than `split` nodes is split: the worker returns its conditional
+        subtrees, which are scheduled as tasks of their own, so one very
+        common item cannot hold a single core long after the rest finish.
+
+        With `share`, the tree is inherited by forked workers instead of
+        being projected in this process: top-level tasks only carry the
+        item to condition on, and workers project, mine and pickle their own
+        subtrees. Pages of the tree are shared copy-on-write; the array
+        backend keeps them shared best since it holds no per-node objects
+        whose reference counts get written to.
+
         Parameters
         ----------
-        tree: Tree
+        tree: Tree/ArrayTree
             The tree to read patterns from
 
         min_support: float
@@ -214,53 +1449,304 @@ class Fpgrowth:
             Number of cores to utilize; default is None, which will auto detect
             the number of cores available to use.
 
+        fparray: bool = False
+            Use FP-arrays (FP-growth*) to count items of conditional trees
+            from pair counts recorded while their parent tree was built,
+            instead of scanning the conditional pattern base. As in
+            FP-growth*, arrays are only recorded for sparse trees; see
+            `is_sparse`.
+
+        split: int/None
+            Number of nodes above which a task is split into subtasks; default
+            is None, which splits trees with more than a quarter of a core's
+            even share of the tree, and 0 never splits.
+
+        share: bool = False
+            Project top-level subtrees inside workers from the master tree
+            shared by forking; falls back to projecting them here where the
+            fork start method is not available.
+
+        interval: float = 60
+            Seconds between progress reports of patterns found per second
+            and the estimated time left.
+
+        shards: str = None
+            Directory to stream patterns into, one shard file per process,
+            rather than returning them; merge the shards with
+            `merge_patterns`.
+
+        mode: str = 'all'
+            Find "all" frequent patterns, only "closed" ones, which no pattern
+            of at most max_size items contains with the same support, or only
+            "maximal" ones, which no other such closed pattern contains. The
+            supports of every subset of a closed pattern can be derived from
+            the closed patterns; see `Association`.
+
+        top: int = 0
+            Find only the top most frequent patterns of at least `min_size`
+            items, along with every smaller pattern at least as frequent, so
+            the supports of their subsets are kept; 0 finds every pattern.
+            The support threshold is raised as patterns are found and is
+            shared with the workers, so every worker prunes by the best
+            bound found so far. Ties at the last support are all kept.
+
+        min_size: int = 1
+            Number of items a pattern needs to be ranked for `top`.
+
+        hybrid: int = 0
+            Number of transactions at or below which conditional trees are
+            finished with bitset intersections rather than projections; see
+            `generate_patterns`. Only applies to finding all patterns.
+
+        heads: list[int] = None
+            Only find the patterns whose least frequent item is one of these
+            items; default is None, which finds every pattern. Without a
+            tree, the partitions of `partition_transactions` are mined if
+            there are any.
+
         Returns
         -------
-        patterns: list[list[float, list[str]]]
-            A list of patterns, where each pattern is a list containing
-            the pattern support value and list of items in the pattern. '''
+        patterns: dict{frozenset[int]: int}/dict{str: int}
+            A dictionary mapping patterns, as sets of item ranks, to their
+            support; decode ranks with `items`. With `shards`, a dictionary
+            mapping the path of every shard to its number of patterns. '''
         
+        if tree is None and getattr(self, 'partitions', None):
+            if top:
+                raise ValueError('Cannot find top patterns across '
+                    'transaction partitions.')
+            return self.find_partitions(min_support, max_support, max_size,
+                cores, fparray=fparray, split=split, share=share, 
+                interval=interval, shards=shards, mode=mode, hybrid=hybrid)
+
         tree = self.tree if tree is None else tree
-        min_support = min_support * tree.root.count
-        max_support = max_support * tree.root.count
-        items = tree.nodes.keys()
+        workers = os.cpu_count() if cores is None else cores
+        if split is None:
+            split = max(tree.count_nodes() // (4 * workers), 1)
+        min_support = min_support * tree.count_transactions()
+        max_support = max_support * tree.count_transactions()
+        items = tree.header()
+        if heads is not None:
+            heads = set(heads)
+            items = [item for item in items if item in heads]
         subtrees = []
         patterns = []
 
-        log.info(f'Balancing tree into tasks for {cores} cores.')
-
-        for item in items:
-            subtree = tree.conditional_tree(item, min_support, max_support)
-            subtrees.append((subtree, min_support, max_support, max_size))
-        subtrees.sort(key=lambda tree: tree[0].root.count_descendents(), reverse=True)
-        
-        global count, n
-        count = Value(c_uint64)
-        count.value = 0
-        n = Value(c_uint64)
-        n.value = 1
+        if mode not in ('all', 'closed', 'maximal'):
+            raise ValueError('Fpgrowth expected mode to be "all", "closed" or '
+                f'"maximal" but got "{mode}".')
+        if mode != 'all' and shards is not None:
+            raise ValueError(f'Cannot find {mode} patterns into shards; they '
+                'have to be filtered together.')
+        if top and (mode != 'all' or shards is not None):
+            raise ValueError('Cannot find top patterns in closed or maximal '
+                'mode nor into shards.')
+
+        if share and 'fork' not in get_all_start_methods():
+            log.warning('Cannot fork workers to share the tree with; top-level '
+                'subtrees will be projected before mining.')
+            share = False
+
+        global progress, master, threshold
+        progress = ProgressUtil('pattern', workers + 1, interval)
+        threshold = Value(c_uint64)
+        threshold.value = 0
+        ranked = []
+        if top and min_size <= 1:
+            for item in items:
+                rank(ranked, tree.support(item), top)
+        def floor():
+            return max(min_support, threshold.value)
+
+        if fparray and tree.fparray is None:
+            if is_sparse({item: tree.support(item) for item in tree.header()},
+                    tree.count_transactions()):
+                log.info('Counting item pairs for frequent pattern array.')
+                tree.fparray = tree.count_pairs()
+            else:
+                log.info('Tree is too dense for a frequent pattern array; '
+                    'only sparse conditional trees will record one.')
+
+        log.info(f'Balancing tree into tasks for {workers} cores.')
+
+        grow = fparray and (max_size == 0 or max_size > 2)
+        scans = 0
+        for item in items if max_size != 1 else ():
+            if top and tree.support(item) < floor():
+                continue
+            if share:
+                subtrees.append(item)
+            else:
+                subtrees.append(tree.conditional_tree(item, floor(), 
+                    max_support, grow))
+                if tree.fparray is not None:
+                    scans += 1
 
         log.info(f'Finding patterns from root node.')
 
+        files = defaultdict(int)
+        if shards is not None:
+            os.makedirs(shards, exist_ok=True)
+            root = PatternShard.create(shards)
+
+        progress.begin()
         for item in items:
-            support = sum([node.count for node in tree.nodes[item]])
-            patterns.append((support, (item,)))
-            if count.value >= n.value:
-                log.info(f'Found pattern {count.value}.')
-                n.value <<= 1
-            count.value += 1
-
-        log.info(f'Now finding remaining patterns on {cores} cores.')
-
-        pool = Pool(processes=cores)
-        for result in pool.starmap(find_patterns, subtrees):
-            patterns.extend(result)
-        if count.value != n.value >> 1:
-            log.info(f'Found pattern {count.value}.')
+            support = tree.support(item)
+            if shards is None:
+                patterns.append((support, (item,)))
+            else:
+                root.write((item,), support)
+                files[root.filepath] += 1
+            progress.add()
+        if shards is not None:
+            root.close()
+
+        log.info(f'Now finding remaining patterns on {workers} cores.')
+
+        # results are collected by the pool's result thread into a queue,
+        # so split tasks can be submitted as soon as they come back
+
+        start = time.perf_counter()
+        if share:
+            master = tree
+            pool = get_context('fork').Pool(processes=workers,
+                initializer=track, initargs=(progress, shards, threshold))
+        else:
+            pool = Pool(processes=workers, initializer=track, 
+                initargs=(progress, shards, threshold))
+        results = Queue()
+        pending = 0
+        submitted = 0
+        durations = []
+        bitsets = {'branches': 0, 'patterns': 0, 'seconds': 0.0}
+        def size(subtree):
+            if isinstance(subtree, int):
+                return tree.support(subtree)
+            return subtree.count_nodes()
+        def submit(subtrees):
+            subtrees.sort(key=size, reverse=True)
+            for subtree in subtrees:
+                pool.apply_async(find_patterns, (subtree, min_support, 
+                    max_support, max_size, fparray, split, mode, top, 
+                    min_size, hybrid),
+                    callback=results.put, error_callback=results.put)
+            return len(subtrees)
+
+        pending += submit(subtrees)
+        submitted += pending
+        progress.update(0, submitted, 'tasks')
+        while pending:
+            result = results.get()
+            pending -= 1
+            if isinstance(result, BaseException):
+                pool.terminate()
+                progress.end()
+                master = None
+                raise result
+            found, subtrees, duration, nodes, stats = result
+            for key in bitsets:
+                bitsets[key] += stats[key]
+            scans += stats['scans']
+            if top:
+                for support, pattern in found:
+                    if len(pattern) >= min_size:
+                        rank(ranked, support, top)
+                patterns.extend(pattern for pattern in found
+                    if pattern[0] >= floor())
+            elif shards is None:
+                patterns.extend(found)
+            elif found[1]:
+                # shards left empty are removed when their worker exits
+                files[found[0]] += found[1]
+            durations.append((duration, nodes, len(subtrees)))
+            log.debug(f'Task over {nodes} nodes took {duration:.3f}s' + 
+                (f' and split into {len(subtrees)} tasks.' if subtrees else '.'))
+            added = submit(subtrees)
+            pending += added
+            submitted += added
+            progress.update(len(durations), submitted)
         pool.close()
         pool.join()
+        master = None
+        progress.end()
+        self.log_tasks(durations, time.perf_counter() - start, workers)
+        if hybrid:
+            self.log_hybrid(durations, bitsets)
+        if fparray:
+            log.info(f'Frequent pattern arrays skipped {scans} counting scans '
+                'of conditional trees.')
+
+        if shards is not None:
+            log.info(f'Streamed {sum(files.values())} patterns into '
+                f'{len(files)} shards in {shards}.')
+            return dict(files)
+
+        if top:
+            ranks = sorted((support for support, pattern in patterns 
+                if len(pattern) >= min_size), reverse=True)
+            last = ranks[top - 1] if len(ranks) >= top else 0
+            patterns = [pattern for pattern in patterns if pattern[0] >= last]
+            log.info(f'Kept {len(patterns)} patterns with a support of at '
+                f'least {last} for the top {top}.')
+
+        patterns = {frozenset(pattern[1]): pattern[0] for pattern in patterns}
+        if mode != 'all':
+            found = len(patterns)
+            patterns = self.filter_patterns(patterns, mode)
+            log.info(f'Kept {len(patterns)} {mode} patterns of {found} '
+                'candidates.')
+
+        return patterns
+
+
+    @classmethod
+    def log_tasks(self, durations, elapsed, workers):
+        '''log how evenly mining tasks were balanced over workers
+
+        Parameters
+        ----------
+        durations: list[tuple(float, int, int)]
+            The duration in seconds, tree size and number of subtasks split
+            off of every task.
+
+        elapsed: float
+            Wall time of the whole run in seconds.
+
+        workers: int
+            Number of worker processes.    '''
+
+        if not durations:
+            return
+        times = sorted(duration for duration, _, _ in durations)
+        splits = sum(1 for _, _, subtasks in durations if subtasks)
+        busy = sum(times)
+        balance = busy / (elapsed * workers) if elapsed else 1
+        log.info(f'Ran {len(times)} tasks ({splits} split) in {elapsed:.2f}s; '
+            f'task durations min {times[0]:.3f}s, median '
+            f'{times[len(times) // 2]:.3f}s, max {times[-1]:.3f}s; workers '
+            f'busy {balance:.0%} of the run.')
+
+
+    @classmethod
+    def log_hybrid(self, durations, bitsets):
+        '''log how mining work was shared between trees and bitsets
+
+        Parameters
+        ----------
+        durations: list[tuple(float, int, int)]
+            The duration in seconds, tree size and number of subtasks split
+            off of every task.
 
-        return {frozenset(pattern[1]): pattern[0] for pattern in patterns}
+        bitsets: dict{str: float}
+            Number of branches, patterns and seconds finished with bitsets,
+            summed over every task.  '''
+
+        busy = sum(duration for duration, _, _ in durations)
+        trees = busy - bitsets['seconds']
+        share = bitsets['seconds'] / busy if busy else 0
+        log.info(f'Bitsets finished {bitsets["branches"]} branches with '
+            f'{bitsets["patterns"]} patterns in {bitsets["seconds"]:.2f}s; '
+            f'trees took {trees:.2f}s, bitsets {share:.0%} of mining time.')
 
 
 class Tree:
@@ -272,9 +1758,74 @@ class Tree:
         The value of the root node; default is None.    '''
 
     def __init__(self, root=None):
-        self.root = Node(root)
+        self.root = Node(root, count=0)
         self.nodes = defaultdict(list)
         self.items = []
+        self.closure = []
+        self.fparray = None
+
+
+    def __getstate__(self):
+        'pickle the tree as flat arrays rather than a deep chain of nodes'
+        return {'nodes': self.flatten(), 'items': self.items, 
+            'closure': self.closure, 'fparray': self.fparray}
+
+
+    def __setstate__(self, state):
+        if 'root' in state:
+            # pickled as a chain of nodes of item names; `Fpgrowth` ranks it
+            self.__init__()
+            self.root = state['root']
+            return
+        tree = self.unflatten(*state['nodes'])
+        self.__dict__.update(tree.__dict__)
+        self.items = state['items']
+        self.closure = state.get('closure', [])
+        self.fparray = state['fparray']
+
+
+    def flatten(self):
+        '''list the nodes of the tree in preorder without recursing
+
+        Returns
+        -------
+        items: array[int]
+            The item of every node; -1 for the root.
+
+        counts: array[int]
+            The count of every node.
+
+        children: array[int]
+            The number of children of every node.   '''
+
+        items = array('i')
+        counts = array('Q')
+        children = array('I')
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            items.append(-1 if node is self.root else node.item)
+            counts.append(node.count)
+            children.append(len(node.children))
+            stack.extend(reversed(list(node.children.values())))
+        return items, counts, children
+
+
+    @classmethod
+    def unflatten(self, items, counts, children):
+        'rebuild a tree from its flattened preorder arrays in a single pass'
+
+        tree = Tree()
+        tree.root.count = counts[0]
+        stack = [[tree.root, children[0]]]
+        for idx in range(1, len(items)):
+            while stack[-1][1] == 0:
+                stack.pop()
+            stack[-1][1] -= 1
+            node = tree.add_node(items[idx], counts[idx], stack[-1][0])
+            if children[idx]:
+                stack.append([node, children[idx]])
+        return tree
     
 
     def insert_itemset(self, itemset, count=1):
@@ -291,42 +1842,190 @@ class Tree:
                 break
 
         for item in itemset[idx:]:
-            child = Node(item, count=count, parent=node)
-            node.children[item] = child
-            self.nodes[item].append(child)
-            node = child
+            node = self.add_node(item, count, node)
+
+
+    def add_node(self, item, count, parent):
+        'create a node as a child of parent and add it to the header table'
+        node = Node(item, count=count, parent=parent)
+        parent.children[item] = node
+        self.nodes[item].append(node)
+        return node
             
 
-    def conditional_tree(self, cond, min_support, max_support):
-        branches = []
-        count = defaultdict(int)
-        for node in self.nodes[cond]:
-            branch = node.itempath()
-            branches.append(branch)
-            for item in branch:
-                count[item] += node.count
+    def conditional_tree(self, cond, min_support, max_support, fparray=False):
+        '''project the tree onto the prefix paths of an item
+
+        Items are integer ranks and every tree is ordered by rank, so the
+        prefix paths are already sorted and only need to be filtered. A
+        first walk up the parent links counts the items, unless the tree has
+        an FP-array to read the counts from; a second one maps each ancestor
+        onto its node in the projected tree, so a shared prefix is projected
+        once rather than copied out for every branch.
+
+        Parameters
+        ----------
+        cond: int
+            The item to condition the tree on.
+
+        min_support: float
+            Minimum conditional count for an item to be kept.
+
+        max_support: float
+            Maximum conditional count for an item to be kept.
+
+        fparray: bool = False
+            Record the FP-array of the conditional tree while it is built,
+            unless it is a path or its pattern base is dense (see
+            `is_sparse`); each projected node keeps the items above
+            it, so its pairs are added once its count is totaled, without
+            another walk up the tree.
+
+        Returns
+        -------
+        tree: Tree
+            The conditional tree, with `items` extended by cond.   '''
+
+        if self.fparray is not None:
+            count = self.fparray.get(cond, {})
+        else:
+            count = defaultdict(int)
+            for node in self.nodes[cond]:
+                parent = node.parent
+                while parent is not self.root:
+                    count[parent.item] += node.count
+                    parent = parent.parent
                 
-        items = [item for item in count if count[item] >= min_support
-            and count[item] <= max_support]
-        items.sort(key=count.get)
-        rank = {item: i for i, item in enumerate(items)}
+        keep = {item for item in count if count[item] >= min_support
+            and count[item] <= max_support}
+        if fparray:
+            fparray = is_sparse({item: count[item] for item in keep},
+                self.support(cond))
 
         tree = Tree()
         tree.items = self.items + [cond]
-        for idx, branch in enumerate(branches):
-            branch = sorted([node for node in branch if node in rank],
-                key=rank.get, reverse=True)
-            tree.insert_itemset(branch, self.nodes[cond][idx].count)
+        projected = {self.root: tree.root}
+        created = []
+        paths = {tree.root: ()}
+        pairs = {}
+        for node in self.nodes[cond]:
+            unmapped = []
+            parent = node.parent
+            while parent not in projected:
+                unmapped.append(parent)
+                parent = parent.parent
+            target = projected[parent]
+            while unmapped:
+                parent = unmapped.pop()
+                if parent.item in keep:
+                    if parent.item in target.children:
+                        target = target.children[parent.item]
+                    else:
+                        child = tree.add_node(parent.item, 0, target)
+                        created.append(child)
+                        if fparray:
+                            paths[child] = paths[target] + (parent.item,)
+                        target = child
+                projected[parent] = target
+            target.count += node.count
+
+        # nodes were created top down, so pushing counts up in reverse
+        # creation order totals every subtree before its parent is read; a
+        # node's total is then final and is added to its pair with every
+        # item above it
+
+        for node in reversed(created):
+            node.parent.count += node.count
+            if fparray:
+                row = pairs.get(node.item)
+                if row is None:
+                    row = pairs[node.item] = defaultdict(int)
+                for item in paths[node.parent]:
+                    row[item] += node.count
+
+        if fparray and not tree.is_path():
+            tree.fparray = pairs
 
         return tree
 
 
+    def count_pairs(self):
+        '''count how often each item occurs with each item above it; this is
+        the FP-array, where row `fparray[item]` holds the item counts of
+        the conditional pattern base of item. Conditional trees record it
+        while they are built; this counts it for trees that were not, such
+        as the tree of every transaction, in the one walk that replaces the
+        counting walks of all of its projections
+
+        Returns
+        -------
+        fparray: dict{int: dict{int: int}}  '''
+
+        fparray = {}
+        for item, nodes in self.nodes.items():
+            row = fparray[item] = defaultdict(int)
+            for node in nodes:
+                parent = node.parent
+                while parent is not self.root:
+                    row[parent.item] += node.count
+                    parent = parent.parent
+        return fparray
+
+
     def is_path(self):
         node = self.root
         while len(node.children) == 1:
             node = list(node.children.values())[0]
         return len(node.children) == 0
 
+
+    def header(self):
+        'list the items in the header table'
+        return list(self.nodes.keys())
+
+
+    def support(self, item):
+        'total count of an item across its nodes'
+        return sum(node.count for node in self.nodes[item])
+
+
+    def itempath(self, node):
+        return node.itempath()
+
+
+    def paths(self):
+        '''list the items of the transactions ending at every node, and how
+        many transactions end there
+
+        Yields
+        ------
+        path: tuple(list[int], int)  '''
+
+        for nodes in self.nodes.values():
+            for node in nodes:
+                count = node.count - sum(child.count 
+                    for child in node.children.values())
+                if count:
+                    yield node.itempath() + [node.item], count
+
+
+    def count_descendents(self, node=None):
+        node = self.root if node is None else node
+        return node.count_descendents()
+
+
+    def count_transactions(self):
+        return self.root.count
+
+
+    def count_events(self):
+        return sum(node.count for nodes in self.nodes.values() 
+            for node in nodes)
+
+
+    def count_nodes(self):
+        return sum(len(nodes) for nodes in self.nodes.values())
+
     
     def print(self):
         pass
@@ -354,7 +2053,13 @@ class Node:
 
 
     def count_descendents(self):
-        return sum(node.count_descendents() + 1 for node in self.children.values())
+        total = 0
+        stack = list(self.children.values())
+        while stack:
+            node = stack.pop()
+            total += 1
+            stack.extend(node.children.values())
+        return total
 
 
     def itempath(self):
@@ -365,3 +2070,317 @@ class Node:
             parent = parent.parent
         path.reverse()
         return path
+
+
+class ArrayTree:
+    '''a tree structure stored in parallel arrays instead of node objects
+
+    Node zero is the root; every other node is an index into the arrays
+    of items, counts, parents, first children, next siblings and node-links
+    (the next node of the same item). Exposes the same interface as `Tree`
+    but costs a few dozen bytes per node rather than a `Node` object and its
+    children dict. Only the root and nodes with at least `wide` children
+    index their children by item, so finding a child of a wide node does
+    not walk every sibling.
+
+    Parameters
+    ----------
+    root: int = -1
+        The item of the root node; default is -1 (no item).    '''
+
+    wide = 8
+
+    def __init__(self, root=-1):
+        self.item = array('i', (root,))
+        self.count = array('I', (0,))
+        self.parent = array('i', (-1,))
+        self.child = array('i', (-1,))
+        self.sibling = array('i', (-1,))
+        self.link = array('i', (-1,))
+        self.heads = {}
+        self.index = {0: {}}
+        self.items = []
+        self.closure = []
+        self.fparray = None
+
+
+    def __setstate__(self, state):
+        if 'roots' in state:
+            state['index'] = {0: state.pop('roots')}
+        self.__dict__.update(state)
+
+
+    def add_node(self, item, count, parent):
+        'append a node as the first child of parent; returns its index'
+        node = len(self.item)
+        self.item.append(item)
+        self.count.append(count)
+        self.parent.append(parent)
+        self.child.append(-1)
+        self.sibling.append(self.child[parent])
+        self.link.append(self.heads.get(item, -1))
+        self.child[parent] = node
+        self.heads[item] = node
+        children = self.index.get(parent)
+        if children is not None:
+            children[item] = node
+        return node
+
+
+    def find_child(self, node, item):
+        '''index of the child of node with item; -1 if there is none. A node
+        whose siblings are walked past `wide` of them gets its children
+        indexed'''
+        children = self.index.get(node)
+        if children is not None:
+            return children.get(item, -1)
+        child = self.child[node]
+        width = 0
+        while child != -1 and self.item[child] != item:
+            child = self.sibling[child]
+            width += 1
+        if width >= self.wide:
+            self.index_children(node)
+        return child
+
+
+    def index_children(self, node):
+        'index the children of node by item'
+        children = self.index[node] = {}
+        child = self.child[node]
+        while child != -1:
+            children[self.item[child]] = child
+            child = self.sibling[child]
+
+
+    def flatten(self):
+        '''list the nodes of the tree in preorder; see `Tree.flatten`'''
+
+        items = array('i')
+        counts = array('Q')
+        children = array('I')
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            items.append(-1 if node == 0 else self.item[node])
+            counts.append(self.count[node])
+            child = self.child[node]
+            kids = []
+            while child != -1:
+                kids.append(child)
+                child = self.sibling[child]
+            children.append(len(kids))
+            stack.extend(reversed(kids))
+        return items, counts, children
+
+
+    @classmethod
+    def unflatten(self, items, counts, children):
+        '''rebuild a tree from its flattened preorder arrays in a single
+        pass; nodes keep their preorder index'''
+
+        size = len(items)
+        tree = ArrayTree()
+        tree.item = array('i', items)
+        tree.item[0] = -1
+        tree.count = array('I', counts)
+        tree.parent = array('i', [-1]) * size
+        tree.child = array('i', [-1]) * size
+        tree.sibling = array('i', [-1]) * size
+        tree.link = array('i', [-1]) * size
+
+        # the stack holds every open node, its children left and its last
+        # child so far, which the next child is linked to as a sibling
+
+        stack = [[0, children[0], -1]] if size else []
+        for node in range(1, size):
+            while stack[-1][1] == 0:
+                stack.pop()
+            frame = stack[-1]
+            parent = frame[0]
+            frame[1] -= 1
+            item = tree.item[node]
+            tree.parent[node] = parent
+            if frame[2] == -1:
+                tree.child[parent] = node
+            else:
+                tree.sibling[frame[2]] = node
+            frame[2] = node
+            tree.link[node] = tree.heads.get(item, -1)
+            tree.heads[item] = node
+            if parent in tree.index:
+                tree.index[parent][item] = node
+            if children[node] >= tree.wide:
+                tree.index[node] = {}
+            if children[node]:
+                stack.append([node, children[node], -1])
+        return tree
+
+
+    def insert_itemset(self, itemset, count=1):
+        node = 0
+        self.count[node] += count
+
+        idx = 0
+        for item in itemset:
+            child = self.find_child(node, item)
+            if child == -1:
+                break
+            node = child
+            self.count[node] += count
+            idx += 1
+
+        for item in itemset[idx:]:
+            node = self.add_node(item, count, node)
+
+
+    def conditional_tree(self, cond, min_support, max_support, fparray=False):
+        'project the tree onto the prefix paths of an item; see `Tree`'
+
+        if self.fparray is not None:
+            count = self.fparray.get(cond, {})
+        else:
+            count = defaultdict(int)
+            for node in self.nodes(cond):
+                parent = self.parent[node]
+                while parent > 0:
+                    count[self.item[parent]] += self.count[node]
+                    parent = self.parent[parent]
+
+        keep = {item for item in count if count[item] >= min_support
+            and count[item] <= max_support}
+        if fparray:
+            fparray = is_sparse({item: count[item] for item in keep},
+                self.support(cond))
+
+        tree = ArrayTree()
+        tree.items = self.items + [cond]
+        projected = {0: 0}
+        paths = [()]
+        pairs = {}
+        for node in self.nodes(cond):
+            unmapped = []
+            parent = self.parent[node]
+            while parent not in projected:
+                unmapped.append(parent)
+                parent = self.parent[parent]
+            target = projected[parent]
+            while unmapped:
+                parent = unmapped.pop()
+                item = self.item[parent]
+                if item in keep:
+                    child = tree.find_child(target, item)
+                    if child == -1:
+                        child = tree.add_node(item, 0, target)
+                        if fparray:
+                            paths.append(paths[target] + (item,))
+                    target = child
+                projected[parent] = target
+            tree.count[target] += self.count[node]
+
+        # children always have higher indices than their parents, so a
+        # node's total is final when it is pushed up, and is then added to
+        # its pair with every item above it
+
+        for node in range(len(tree.item) - 1, 0, -1):
+            tree.count[tree.parent[node]] += tree.count[node]
+            if fparray:
+                row = pairs.get(tree.item[node])
+                if row is None:
+                    row = pairs[tree.item[node]] = defaultdict(int)
+                for item in paths[tree.parent[node]]:
+                    row[item] += tree.count[node]
+
+        if fparray and not tree.is_path():
+            tree.fparray = pairs
+
+        return tree
+
+
+    def count_pairs(self):
+        'count the FP-array of item pair counts; see `Tree`'
+
+        fparray = {}
+        for node in range(1, len(self.item)):
+            row = fparray.get(self.item[node])
+            if row is None:
+                row = fparray[self.item[node]] = defaultdict(int)
+            parent = self.parent[node]
+            while parent > 0:
+                row[self.item[parent]] += self.count[node]
+                parent = self.parent[parent]
+        return fparray
+
+
+    def is_path(self):
+        node = self.child[0]
+        while node != -1:
+            if self.sibling[node] != -1:
+                return False
+            node = self.child[node]
+        return True
+
+
+    def header(self):
+        'list the items in the header table'
+        return list(self.heads.keys())
+
+
+    def nodes(self, item):
+        'iterate over the nodes of an item by following node-links'
+        node = self.heads.get(item, -1)
+        while node != -1:
+            yield node
+            node = self.link[node]
+
+
+    def support(self, item):
+        'total count of an item across its nodes'
+        return sum(self.count[node] for node in self.nodes(item))
+
+
+    def itempath(self, node):
+        'items on the path from the root down to (excluding) node'
+        path = []
+        parent = self.parent[node]
+        while parent > 0:
+            path.append(self.item[parent])
+            parent = self.parent[parent]
+        path.reverse()
+        return path
+
+
+    def paths(self):
+        'list the transactions ending at every node; see `Tree`'
+        ends = array('q', self.count)
+        for node in range(1, len(self.item)):
+            ends[self.parent[node]] -= self.count[node]
+        for node in range(1, len(self.item)):
+            if ends[node]:
+                yield self.itempath(node) + [self.item[node]], ends[node]
+
+
+    def count_descendents(self, node=0):
+        if node == 0:
+            return len(self.item) - 1
+        total = 0
+        stack = [self.child[node]]
+        while stack:
+            child = stack.pop()
+            while child != -1:
+                total += 1
+                stack.append(self.child[child])
+                child = self.sibling[child]
+        return total
+
+
+    def count_transactions(self):
+        return self.count[0]
+
+
+    def count_events(self):
+        return sum(self.count) - self.count[0]
+
+
+    def count_nodes(self):
+        return len(self.item) - 1
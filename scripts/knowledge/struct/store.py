@@ -0,0 +1,698 @@
+import gzip
+import csv
+import json
+import os
+import struct
+import numpy as np
+import logging as log
+
+from array import array
+
+from knowledge.struct.transaction import split_rows
+
+
+def multiopen(filepath, **kwargs):
+    'autodetect compressed file'
+
+    if filepath.split('.')[-1] == 'gz':
+        data = gzip.open(filepath, **kwargs)
+    else:
+        data = open(filepath, **kwargs)
+    return data
+
+
+class PatternShard:
+    '''append-only csv file of the patterns found by one process; rows
+    hold the sorted item ranks of a pattern followed by its support
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the shard to write; truncated if it already exists, and
+        removed on close if nothing was written to it.  '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.count = 0
+        self.data = open(filepath, 'w', newline='')
+        self.writer = csv.writer(self.data, delimiter=',', quotechar='"')
+
+
+    @classmethod
+    def create(self, directory):
+        'open the shard of the current process in a directory'
+        return self(os.path.join(directory, f'patterns-{os.getpid()}.csv'))
+
+
+    def write(self, pattern, support):
+        self.writer.writerow((*sorted(pattern), support))
+        self.count += 1
+
+
+    def flush(self):
+        self.data.flush()
+
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+            if not self.count:
+                os.remove(self.filepath)
+
+
+class TransactionPartition:
+    '''transactions projected onto a group of items, kept on disk as two
+    append-only files of uint32s: the length of every transaction, and the
+    item ranks of every transaction one after the other
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the partition without extension; the lengths are written to
+        ".len" and the item ranks to ".ids", truncating existing files.
+
+    items: list[int]
+        The item ranks of the group.
+
+    Attributes
+    ----------
+    rows: int
+        Number of transactions written.
+
+    occurrences: int
+        Number of item ranks written.
+
+    transactions: int
+        Number of transactions projected, including those without items of
+        the group.   '''
+
+    def __init__(self, filepath, items, buffer=65536):
+        self.filepath = filepath
+        self.items = items
+        self.buffer = buffer
+        self.rows = 0
+        self.occurrences = 0
+        self.transactions = 0
+        self.lengths = array('I')
+        self.ids = array('I')
+        for ext in ('.len', '.ids'):
+            open(filepath + ext, 'wb').close()
+
+
+    def append(self, itemset):
+        self.lengths.append(len(itemset))
+        self.ids.extend(itemset)
+        self.rows += 1
+        self.occurrences += len(itemset)
+        if len(self.ids) >= self.buffer:
+            self.flush()
+
+
+    def flush(self):
+        'append the buffered transactions to the files'
+        with open(self.filepath + '.len', 'ab') as data:
+            self.lengths.tofile(data)
+        with open(self.filepath + '.ids', 'ab') as data:
+            self.ids.tofile(data)
+        self.lengths = array('I')
+        self.ids = array('I')
+
+
+    def itemsets(self, chunksize=65536):
+        '''stream the transactions of the partition from memory maps
+
+        Yields
+        ------
+        itemset: list[int]  '''
+
+        if not self.rows:
+            return
+        lengths = np.memmap(self.filepath + '.len', dtype=np.uint32, mode='r')
+        offsets = np.zeros(self.rows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.memmap(self.filepath + '.ids', dtype=np.uint32, mode='r')
+        for start in range(0, self.rows, chunksize):
+            stop = min(start + chunksize, self.rows)
+            ranks = ids[offsets[start]:offsets[stop]].astype(np.int64)
+            rows = np.repeat(np.arange(stop - start), lengths[start:stop])
+            yield from split_rows(rows, ranks, stop - start)
+
+
+    def remove(self):
+        for ext in ('.len', '.ids'):
+            os.remove(self.filepath + ext)
+
+
+class TreeStore:
+    '''binary file of a frequent pattern tree and its item dictionary
+
+    The tree is stored as preorder arrays of the item, count and number of
+    children of every node (see `Tree.flatten`), so it is rebuilt in one
+    linear pass without recursion or a `Node` object per unpickled node.
+    The arrays are opened with `numpy.memmap` unless the file is gzipped.
+
+    The file starts with the magic bytes and a header of little-endian
+    uint64s (nodes, items, and the byte offsets of the count array, the
+    children array, the support array, the extra array, the item dictionary
+    and the metadata), followed by the int32 node items, the uint64 node
+    counts, the uint32 child counts, the uint64 support of every item by
+    rank, the raw bytes of an extra array (the bitsets of `Eclat`), the
+    newline separated, utf-8 item dictionary in rank order and utf-8 json
+    metadata: the class and backend the tree was built with, the attributes
+    of the tree and any other attributes of the instance. Frequent pattern
+    arrays are not stored; they are counted again when needed.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the file to open; gzipped if it ends with ".gz".    '''
+
+    magic = b'KNOWFPT1'
+    header = struct.Struct('<8s8Q')
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.buffer = None
+        if filepath.split('.')[-1] == 'gz':
+            with multiopen(filepath, mode='rb') as data:
+                self.buffer = data.read()
+            head = self.buffer[:self.header.size]
+        else:
+            with open(filepath, 'rb') as data:
+                head = data.read(self.header.size)
+        (magic, nodes, items, counts, children, support, extra, names, 
+            meta) = self.header.unpack(head)
+        if magic != self.magic:
+            raise ValueError(f'File {filepath} is not a tree store.')
+
+        self.items = self.array(np.int32, self.header.size, nodes)
+        self.counts = self.array(np.uint64, counts, nodes)
+        self.children = self.array(np.uint32, children, nodes)
+        self.support = self.array(np.uint64, support, items)
+        self.extra = self.array(np.uint8, extra, names - extra)
+        text = self.array(np.uint8, names, None).tobytes()
+        self.names = text[:meta - names].decode('utf-8').split('\n')
+        self.names = self.names if items else []
+        self.meta = json.loads(text[meta - names:].decode('utf-8'))
+
+
+    def array(self, dtype, offset, size):
+        'map or read an array of the file; size None reads to the end'
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        if self.buffer is not None:
+            return np.frombuffer(self.buffer, dtype=dtype, offset=offset,
+                count=-1 if size is None else size)
+        return np.memmap(self.filepath, dtype=dtype, mode='r', offset=offset,
+            shape=None if size is None else (size,))
+
+
+    @classmethod
+    def is_store(self, filepath):
+        'check whether a file is a tree store'
+        with multiopen(filepath, mode='rb') as data:
+            return data.read(len(self.magic)) == self.magic
+
+
+    @classmethod
+    def write(self, filepath, fpgrowth):
+        '''write an `Fpgrowth`, or one of its subclasses, to a tree file
+
+        Parameters
+        ----------
+        filepath: str
+            Path of the file to write; gzipped if it ends with ".gz".
+
+        fpgrowth: Fpgrowth   '''
+
+        # imported here since the engine modules import this one
+        from knowledge.struct.fpgrowth import ArrayTree
+
+        tree = getattr(fpgrowth, 'tree', None)
+        if tree is not None:
+            items, counts, children = tree.flatten()
+        else:
+            items, counts, children = array('i'), array('Q'), array('I')
+        support = array('Q', (fpgrowth.support[item] 
+            for item in fpgrowth.items))
+        extra = getattr(fpgrowth, 'bitsets', None)
+        extra = b'' if extra is None else extra.tobytes()
+
+        attributes = {}
+        for key, value in vars(fpgrowth).items():
+            if key in ('tree', 'support', 'items', 'ranks', 'bitsets'):
+                continue
+            if key == 'partitions' and value is not None:
+                value = [{key: value for key, value in vars(part).items()
+                    if key not in ('lengths', 'ids')} for part in value]
+            attributes[key] = value
+        meta = {'class': type(fpgrowth).__name__, 'attributes': attributes}
+        if tree is not None:
+            meta['backend'] = 'array' if isinstance(tree, ArrayTree) else \
+                'object'
+            meta['tree'] = {'items': tree.items, 'closure': tree.closure}
+        if extra:
+            meta['extra'] = list(fpgrowth.bitsets.shape)
+        names = '\n'.join(fpgrowth.items).encode('utf-8')
+        meta = json.dumps(meta).encode('utf-8')
+
+        def pad(offset):
+            return -offset % 8
+
+        nodes = len(items)
+        offsets = [self.header.size + 4 * nodes]
+        offsets[0] += pad(offsets[0])
+        offsets.append(offsets[0] + 8 * nodes)
+        offsets.append(offsets[1] + 4 * nodes + pad(offsets[1] + 4 * nodes))
+        offsets.append(offsets[2] + 8 * len(support))
+        offsets.append(offsets[3] + len(extra))
+        offsets.append(offsets[4] + len(names))
+
+        data = multiopen(filepath, mode='wb')
+        data.write(self.header.pack(self.magic, nodes, len(support), 
+            *offsets))
+        data.write(items.tobytes())
+        data.write(b'\0' * pad(self.header.size + 4 * nodes))
+        data.write(counts.tobytes())
+        data.write(children.tobytes())
+        data.write(b'\0' * pad(offsets[1] + 4 * nodes))
+        data.write(support.tobytes())
+        data.write(extra)
+        data.write(names)
+        data.write(meta)
+        data.close()
+
+        log.info(f'Stored tree of {nodes} nodes and {len(support)} items in '
+            f'{filepath}.')
+
+
+    def load(self):
+        '''rebuild the instance written to the file
+
+        Returns
+        -------
+        fpgrowth: Fpgrowth
+            An instance of the class that was written.  '''
+
+        # imported here since the engine modules import this one
+        from knowledge.struct.fpgrowth import Fpgrowth, Tree, ArrayTree
+        from knowledge.struct.eclat import Eclat
+        from knowledge.struct.toivonen import Toivonen
+
+        classes = {'Fpgrowth': Fpgrowth, 'Eclat': Eclat, 'Toivonen': Toivonen}
+        fpgrowth = object.__new__(classes[self.meta['class']])
+        fpgrowth.items = list(self.names)
+        fpgrowth.support = dict(zip(self.names, self.support.tolist()))
+        fpgrowth.ranks = {item: rank for rank, item in enumerate(self.names)}
+
+        attributes = dict(self.meta['attributes'])
+        if attributes.get('partitions') is not None:
+            partitions = []
+            for state in attributes['partitions']:
+                partition = object.__new__(TransactionPartition)
+                partition.__dict__.update(state)
+                partition.lengths = array('I')
+                partition.ids = array('I')
+                partitions.append(partition)
+            attributes['partitions'] = partitions
+        fpgrowth.__dict__.update(attributes)
+
+        if 'extra' in self.meta:
+            fpgrowth.bitsets = np.array(self.extra).reshape(self.meta['extra'])
+        elif self.meta['class'] == 'Eclat':
+            fpgrowth.bitsets = np.zeros((len(fpgrowth.items), 0), 
+                dtype=np.uint8)
+
+        if 'tree' in self.meta:
+            backend = Tree if self.meta['backend'] == 'object' else ArrayTree
+            if len(self.items):
+                fpgrowth.tree = backend.unflatten(self.items.tolist(), 
+                    self.counts.tolist(), self.children.tolist())
+            else:
+                fpgrowth.tree = backend()
+            fpgrowth.tree.items = self.meta['tree']['items']
+            fpgrowth.tree.closure = self.meta['tree']['closure']
+        return fpgrowth
+
+
+class PatternStore:
+    '''binary file of frequent patterns with a hash index for exact lookups
+
+    Patterns are grouped by their number of items; a group holds the rank
+    sorted item ranks of its patterns as a fixed width uint32 array of one
+    row per pattern, and their supports as a uint64 column. Patterns are
+    numbered group after group, in increasing length. The index hashes the
+    ranks of every pattern into a bucket, and lists pattern numbers bucket
+    after bucket, so a lookup only compares the rows of one bucket. The
+    postings list the numbers of the patterns holding every item, item after
+    item, so the supersets of a pattern are the intersection of the postings
+    of its items. Every
+    array is opened with `numpy.memmap` unless the file is gzipped, so
+    patterns are looked up without being loaded as Python objects; pickling
+    a store only pickles its path.
+
+    The file starts with the magic bytes and a header of little-endian
+    uint64s (patterns, items, transactions, zero if unknown, groups,
+    buckets, and the byte offsets of the group table, the index, the
+    postings and the item dictionary), followed
+    by the ranks and supports of every group, the group table of a length,
+    a count and the byte offsets of the ranks and supports of every group,
+    the uint64 start of every bucket, the uint64 pattern numbers of every
+    bucket, the uint64 start of the postings of every item, the ascending
+    uint64 pattern numbers of every item and the newline separated, utf-8
+    item dictionary in rank order.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the store to open; gzipped if it ends with ".gz".    '''
+
+    magic = b'KNOWPAT3'
+    header = struct.Struct('<8s9Q')
+    basis = 0xcbf29ce484222325
+    prime = 0x100000001b3
+    mask = 0xffffffffffffffff
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.buffer = None
+        if filepath.split('.')[-1] == 'gz':
+            with multiopen(filepath, mode='rb') as data:
+                self.buffer = data.read()
+            head = self.buffer[:self.header.size]
+        else:
+            with open(filepath, 'rb') as data:
+                head = data.read(self.header.size)
+        (magic, patterns, items, transactions, groups, buckets, table, index,
+            postings, names) = self.header.unpack(head)
+        if magic != self.magic:
+            if magic[:7] == self.magic[:7]:
+                raise ValueError(f'Pattern store {filepath} was written by an '
+                    'older version; write its patterns again.')
+            raise ValueError(f'File {filepath} is not a pattern store.')
+
+        self.count = patterns
+        self.transactions = transactions or None
+        self.buckets = buckets
+        self.groups = {}
+        start = 0
+        table = self.array(np.uint64, table, 4 * groups).reshape(-1, 4)
+        for length, count, ranks, supports in table.tolist():
+            self.groups[length] = (start, 
+                self.array(np.uint32, ranks, length * count).reshape(-1, 
+                    length),
+                self.array(np.uint64, supports, count))
+            start += count
+        self.offsets = self.array(np.uint64, index, buckets + 1)
+        self.slots = self.array(np.uint64, index + 8 * (buckets + 1), 
+            patterns)
+        self.starts = self.array(np.uint64, postings, items + 1)
+        self.postings = self.array(np.uint64, postings + 8 * (items + 1),
+            int(self.starts[-1]) if items else 0)
+        text = self.array(np.uint8, names, None).tobytes()
+        self.items = text.decode('utf-8').split('\n') if items else []
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __iter__(self):
+        for pattern, _ in self.patterns():
+            yield pattern
+
+
+    def __contains__(self, pattern):
+        return self.get(pattern) is not None
+
+
+    def __getitem__(self, pattern):
+        support = self.get(pattern)
+        if support is None:
+            raise KeyError(pattern)
+        return support
+
+
+    def __getstate__(self):
+        return {'filepath': self.filepath}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['filepath'])
+
+
+    def array(self, dtype, offset, size):
+        'map or read an array of the file; size None reads to the end'
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        if self.buffer is not None:
+            return np.frombuffer(self.buffer, dtype=dtype, offset=offset,
+                count=-1 if size is None else size)
+        return np.memmap(self.filepath, dtype=dtype, mode='r', offset=offset,
+            shape=None if size is None else (size,))
+
+
+    @classmethod
+    def is_store(self, filepath):
+        'check whether a file is a pattern store, of any version'
+        with multiopen(filepath, mode='rb') as data:
+            return data.read(len(self.magic))[:7] == self.magic[:7]
+
+
+    @classmethod
+    def hash(self, ranks):
+        '''hash rank sorted patterns of the same length into buckets
+
+        Parameters
+        ----------
+        ranks: numpy.ndarray[uint32]
+            The item ranks of one pattern per row.
+
+        Returns
+        -------
+        hashes: numpy.ndarray[uint64]   '''
+
+        hashes = np.full(len(ranks), self.basis ^ ranks.shape[1], 
+            dtype=np.uint64)
+        for column in ranks.T:
+            hashes ^= column.astype(np.uint64)
+            hashes *= np.uint64(self.prime)
+        return hashes ^ (hashes >> np.uint64(32))
+
+
+    def bucket(self, key):
+        'bucket of a rank sorted pattern; see `hash`'
+        value = self.basis ^ len(key)
+        for rank in key:
+            value = ((value ^ rank) * self.prime) & self.mask
+        return (value ^ (value >> 32)) % self.buckets
+
+
+    def find(self, key):
+        '''find a pattern in the index
+
+        Parameters
+        ----------
+        key: list[int]
+            Rank sorted item ranks of the pattern.
+
+        Returns
+        -------
+        row: int
+            Row of the pattern in the group of its length, or -1 if the
+            pattern is not in the store.  '''
+
+        group = self.groups.get(len(key))
+        if group is None:
+            return -1
+        start, ranks, _ = group
+        bucket = self.bucket(key)
+        low, high = self.offsets[bucket:bucket + 2].tolist()
+        for row in self.slots[low:high].tolist():
+            row -= start
+            if 0 <= row < len(ranks) and ranks[row].tolist() == key:
+                return row
+        return -1
+
+
+    def get(self, pattern, default=None):
+        '''support of a pattern
+
+        Parameters
+        ----------
+        pattern: iterable[int]
+            The item ranks of the pattern, in any order.
+
+        default: int = None
+            Returned if the pattern is not in the store.
+
+        Returns
+        -------
+        support: int    '''
+
+        key = sorted(pattern)
+        row = self.find(key)
+        if row < 0:
+            return default
+        return int(self.groups[len(key)][2][row])
+
+
+    def pattern(self, number):
+        'numbered pattern and its support'
+        for start, ranks, supports in self.groups.values():
+            if number < start + len(supports):
+                row = number - start
+                return frozenset(ranks[row].tolist()), int(supports[row])
+        raise IndexError(number)
+
+
+    def supersets(self, key):
+        '''patterns holding every item of a pattern, itself included
+
+        Parameters
+        ----------
+        key: iterable[int]
+            Item ranks of the pattern.
+
+        Returns
+        -------
+        supersets: list[tuple(frozenset[int], int)]
+            The supersets and their support, in number order.  '''
+
+        postings = []
+        for rank in key:
+            low, high = self.starts[rank:rank + 2].tolist()
+            postings.append(self.postings[low:high])
+        postings.sort(key=len)
+        numbers = postings[0]
+        for other in postings[1:]:
+            if not len(numbers):
+                break
+            numbers = np.intersect1d(numbers, other, assume_unique=True)
+        return [self.pattern(number) for number in numbers.tolist()]
+
+
+    def patterns(self, start=0, stop=None, chunksize=65536):
+        '''iterate over numbered patterns and their support
+
+        Parameters
+        ----------
+        start: int = 0
+            Number of the first pattern.
+
+        stop: int = None
+            Number past the last pattern; default is every pattern.
+
+        chunksize: int = 65536
+            Number of patterns to read from the arrays at a time.
+
+        Yields
+        ------
+        pattern: tuple(frozenset[int], int)   '''
+
+        stop = self.count if stop is None else stop
+        for first, ranks, supports in self.groups.values():
+            low = max(start - first, 0)
+            high = min(stop - first, len(supports))
+            for offset in range(low, high, chunksize):
+                end = min(offset + chunksize, high)
+                yield from zip(map(frozenset, ranks[offset:end].tolist()), 
+                    supports[offset:end].tolist())
+
+
+    def size(self, max_size=0):
+        'number of patterns of at most `max_size` items; 0 is unbounded'
+        return sum(len(supports) for length, (_, _, supports) in 
+            self.groups.items() if not max_size or length <= max_size)
+
+
+    @classmethod
+    def write(self, filepath, patterns, items, transactions=None):
+        '''write patterns into a new store
+
+        Parameters
+        ----------
+        filepath: str
+            Path of the store to write; gzipped if it ends with ".gz".
+
+        patterns: iterable[tuple(iterable[int], int)]
+            Patterns as item ranks, in any order, and their support; read
+            once, so it may be a stream of pattern shards.
+
+        items: list[str]
+            The item dictionary of the ranks.
+
+        transactions: int = None
+            Number of transactions the patterns were found in, if known;
+            read back as `transactions`.  '''
+
+        groups = {}
+        for pattern, support in patterns:
+            key = sorted(pattern)
+            if len(key) not in groups:
+                groups[len(key)] = (array('I'), array('Q'))
+            ranks, supports = groups[len(key)]
+            ranks.extend(key)
+            supports.append(int(support))
+        groups = {length: groups[length] for length in sorted(groups)}
+        count = sum(len(supports) for _, supports in groups.values())
+        buckets = 1 << max(count - 1, 0).bit_length()
+
+        def pad(offset):
+            return -offset % 8
+
+        table = []
+        hashes = []
+        columns = []
+        numbers = []
+        start = 0
+        offset = self.header.size
+        for length, (ranks, supports) in groups.items():
+            table.append((length, len(supports), offset, 
+                offset + 4 * len(ranks) + pad(4 * len(ranks))))
+            offset = table[-1][3] + 8 * len(supports)
+            matrix = np.frombuffer(ranks, dtype=np.uint32).reshape(-1, length)
+            hashes.append(self.hash(matrix))
+            columns.append(matrix.ravel())
+            numbers.append(np.repeat(np.arange(start, start + len(supports), 
+                dtype=np.uint64), length))
+            start += len(supports)
+        hashes = np.concatenate(hashes) if hashes else np.zeros(0, 
+            dtype=np.uint64)
+        hashes = (hashes % np.uint64(buckets)).astype(np.int64)
+        slots = np.argsort(hashes, kind='stable').astype(np.uint64)
+        offsets = np.zeros(buckets + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(hashes, minlength=buckets), out=offsets[1:])
+
+        # numbers are ascending within an item since the sort is stable
+
+        columns = np.concatenate(columns).astype(np.int64) if columns \
+            else np.zeros(0, dtype=np.int64)
+        numbers = np.concatenate(numbers) if numbers else np.zeros(0, 
+            dtype=np.uint64)
+        postings = numbers[np.argsort(columns, kind='stable')]
+        starts = np.zeros(len(items) + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(columns, minlength=len(items)), out=starts[1:])
+        table = np.array(table, dtype=np.uint64).reshape(-1, 4)
+        index = offset + table.nbytes
+        inverted = index + offsets.nbytes + slots.nbytes
+        names = inverted + starts.nbytes + postings.nbytes
+
+        data = multiopen(filepath, mode='wb')
+        data.write(self.header.pack(self.magic, count, len(items), 
+            transactions or 0, len(table), buckets, offset, index, inverted,
+            names))
+        for ranks, supports in groups.values():
+            data.write(ranks.tobytes())
+            data.write(b'\0' * pad(4 * len(ranks)))
+            data.write(supports.tobytes())
+        data.write(table.tobytes())
+        data.write(offsets.tobytes())
+        data.write(slots.tobytes())
+        data.write(starts.tobytes())
+        data.write(postings.tobytes())
+        data.write('\n'.join(items).encode('utf-8'))
+        data.close()
+
+        log.info(f'Stored {count} patterns of {len(table)} lengths in '
+            f'{filepath}.')
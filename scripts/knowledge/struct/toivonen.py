@@ -0,0 +1,383 @@
+
+import numpy as np
+import logging as log
+
+from array import array
+from math import log as ln, sqrt
+from itertools import combinations, groupby
+
+from knowledge.struct.eclat import pack_rows, popcount
+from knowledge.struct.fpgrowth import Fpgrowth
+
+
+class Toivonen(Fpgrowth):
+    '''approximate frequent pattern mining on a random sample of transactions
+
+    Only a random sample of the transactions is built into the tree, which
+    is mined at a minimum support lowered by a Hoeffding bound, so that a
+    pattern frequent in every transaction is missed from the sample with a
+    probability of at most one less the confidence. Supports are estimated
+    by scaling the sample counts up to every transaction.
+
+    A verification pass (`verify_patterns`) counts the exact supports of the
+    sampled patterns and of their negative border, the smallest patterns
+    that are not frequent in the sample but all of whose subsets are, over
+    every transaction. If no pattern of the border is frequent, the
+    verified patterns are exactly those `Fpgrowth` finds; otherwise the
+    frequent border patterns are reported, since patterns containing them
+    may be missing. A maximum support below one is only checked on the
+    patterns found, so the border does not account for it.
+
+    Parameters
+    ----------
+    support: dict{str: int}
+        A dictionary mapping the names of items to their support over every
+        transaction.
+
+    backend: str = 'object'
+        The tree implementation; see `Fpgrowth`.
+
+    Attributes
+    ----------
+    transactions: int
+        Number of transactions the sample was drawn from.
+
+    sampled: int
+        Number of transactions in the sample.
+
+    floor: float
+        The lowered minimum support count the sample was last mined at. '''
+
+    def __init__(self, support, backend='object'):
+        super().__init__(support, backend)
+        self.transactions = 0
+        self.sampled = 0
+        self.floor = 0
+        self.filepath = None
+        self.fmt = None
+
+
+    def load_transactions(self, filepath, fmt='auto', chunksize=65536,
+            dedupe=True, fraction=0.1, seed=None):
+        '''stream a transactions file, building a random sample of it into
+        the tree
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the transactions file; kept for `verify_patterns`.
+
+        fmt: str = 'auto'
+            Layout of the file, "dense", "sparse", "csr" or "auto".
+
+        chunksize: int = 65536
+            Number of dense or csr transactions to decode, and of sampled
+            itemsets to deduplicate, at a time.
+
+        dedupe: bool = True
+            Deduplicate sampled itemsets before inserting them; see
+            `Fpgrowth.load_transactions`.
+
+        fraction: float = 0.1
+            Probability of every transaction to be sampled.
+
+        seed: int = None
+            Seed of the random sample; default is None, which draws a
+            different sample every run.   '''
+
+        self.filepath = filepath
+        self.fmt = fmt
+        self.transactions = 0
+        generator = np.random.default_rng(seed)
+
+        def sample():
+            for itemset in self.encode_transactions(filepath, fmt, chunksize):
+                self.transactions += 1
+                if generator.random() < fraction:
+                    yield itemset
+
+        self.sampled = self.insert_itemsets(sample(), dedupe=dedupe, 
+            chunksize=chunksize)
+        log.info(f'Sampled {self.sampled} of {self.transactions} '
+            'transactions.')
+
+
+    def find_patterns(self, tree=None, min_support=0, max_support=1, 
+            max_size=0, cores=None, fparray=False, split=None, share=False,
+            interval=60, shards=None, mode='all', top=0, min_size=1,
+            hybrid=0, heads=None, *, confidence=0.95):
+        '''finds patterns from the sample, at a lowered minimum support
+
+        The minimum support is lowered, and the maximum support raised, by
+        sqrt(ln(1 / (1 - confidence)) / 2n) for a sample of n transactions.
+        Parameters are those of `Fpgrowth.find_patterns`, where tree is the
+        sample tree by default; closed, maximal, top and sharded patterns
+        are not estimated.
+
+        Parameters
+        ----------
+        confidence: float = 0.95
+            Probability of a frequent pattern to be found frequent in the
+            sample; must be less than one.
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            A dictionary mapping patterns, as sets of item ranks, to their
+            estimated support; single items have their exact support. '''
+
+        if shards is not None:
+            raise ValueError('Cannot estimate patterns with shards.')
+        if top:
+            raise ValueError('Cannot estimate patterns with top.')
+        if mode != 'all':
+            raise ValueError('Cannot estimate closed or maximal patterns.')
+
+        tree = self.tree if tree is None else tree
+        sampled = tree.count_transactions()
+        slack = sqrt(ln(1 / (1 - confidence)) / (2 * sampled)) if sampled else 0
+        lowered = max(min_support - slack, 0)
+        raised = min(max_support + slack, 1)
+        self.floor = lowered * sampled
+        log.info(f'Mining sample of {sampled} transactions at supports '
+            f'between {lowered:.4f} and {raised:.4f}; slack of {slack:.4f} '
+            f'at {confidence} confidence.')
+
+        found = super().find_patterns(tree=tree, min_support=lowered, 
+            max_support=raised, max_size=max_size, cores=cores, 
+            fparray=fparray, split=split, share=share, interval=interval,
+            min_size=min_size, hybrid=hybrid, heads=heads)
+
+        scale = self.transactions / sampled if sampled else 0
+        patterns = {pattern: round(support * scale)
+            for pattern, support in found.items() if len(pattern) > 1}
+        for rank, item in enumerate(self.items):
+            if self.support[item]:
+                patterns[frozenset((rank,))] = self.support[item]
+
+        return patterns
+
+
+    def negative_border(self, patterns, max_size=0):
+        '''find the negative border of the patterns frequent in the sample
+
+        Parameters
+        ----------
+        patterns: iterable[frozenset[int]]
+            The patterns of at least two items found in the sample.
+
+        max_size: int = 0
+            Largest border pattern to find; 0 is unbounded.
+
+        Returns
+        -------
+        border: list[tuple[int]]
+            Rank sorted border patterns.  '''
+
+        frequent = {(item,) for item in self.tree.header()
+            if self.tree.support(item) >= self.floor}
+        found = frequent | {tuple(sorted(pattern)) for pattern in patterns
+            if len(pattern) > 1}
+        border = [(item,) for item in range(len(self.items))
+            if (item,) not in found]
+
+        size = 1
+        level = sorted(frequent)
+        while level and (not max_size or size < max_size):
+            for prefix, keys in groupby(level, key=lambda key: key[:-1]):
+                for first, second in combinations([key[-1] for key in keys], 2):
+                    candidate = prefix + (first, second)
+                    if candidate in found:
+                        continue
+                    if all(candidate[:idx] + candidate[idx + 1:] in found
+                            for idx in range(len(prefix))):
+                        border.append(candidate)
+            size += 1
+            level = sorted(key for key in found if len(key) == size)
+
+        return border
+
+
+    def count_patterns(self, patterns, filepath=None, fmt=None,
+            chunksize=65536):
+        '''count the exact supports of patterns in one pass over every
+        transaction
+
+        Every block of transactions is packed into a bitset per item of the
+        patterns, straight from the items of its transactions, and
+        patterns are visited in rank order so the intersections of a shared
+        prefix are reused rather than taken again.
+
+        Parameters
+        ----------
+        patterns: iterable[tuple[int]]
+            Rank sorted patterns to count.
+
+        filepath: str = None
+            Path to the transactions file; default is the sampled file.
+
+        fmt: str = None
+            Layout of the file; default is that of the sampled file.
+
+        chunksize: int = 65536
+
+        Returns
+        -------
+        supports: dict{tuple[int]: int} '''
+
+        filepath = self.filepath if filepath is None else filepath
+        fmt = self.fmt if fmt is None else fmt
+        keys = sorted(set(patterns))
+        columns = sorted({item for key in keys for item in key})
+        lookup = np.full(len(self.items), -1, dtype=np.int64)
+        lookup[columns] = np.arange(len(columns))
+        counts = [0] * len(keys)
+        rows = array('q')
+        cols = array('q')
+        size = 0
+        count = 0
+        n = 1
+
+        def tally():
+            bitsets = pack_rows(np.array(rows, dtype=np.int64), 
+                np.array(cols, dtype=np.int64), len(columns), size)
+            stack = []
+            previous = ()
+            for idx, key in enumerate(keys):
+                common = 0
+                while (common < min(len(previous), len(key)) and
+                        previous[common] == key[common]):
+                    common += 1
+                del stack[common:]
+                for item in key[common:]:
+                    bits = bitsets[lookup[item]]
+                    stack.append(stack[-1] & bits if stack else bits)
+                counts[idx] += popcount(stack[-1])
+                previous = key
+
+        for itemset in self.encode_transactions(filepath, fmt, chunksize):
+            found = [col for col in lookup[itemset].tolist() if col >= 0]
+            rows.extend([size] * len(found))
+            cols.extend(found)
+            size += 1
+            count += 1
+            if size == chunksize:
+                tally()
+                rows = array('q')
+                cols = array('q')
+                size = 0
+            if count == n:
+                log.info(f'Processed transaction {count}.')
+                n <<= 1
+
+        if size:
+            tally()
+        if count != n >> 1:
+            log.info(f'Processed transaction {count}.')
+
+        return dict(zip(keys, counts))
+
+
+    def bound_patterns(self, patterns, min_support=0, max_support=1):
+        '''keep the patterns of which every suffix of at least two items, in
+        rank order, has a support within bounds, as `Fpgrowth` keeps them
+        since it grows patterns from their least frequent item; use on
+        estimated patterns to drop those only found at the lowered minimum
+        support
+
+        Parameters
+        ----------
+        patterns: dict{frozenset[int]: int}
+
+        min_support: float
+
+        max_support: float
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            The patterns kept, along with every item with its exact
+            support. '''
+
+        min_support = min_support * self.transactions
+        max_support = max_support * self.transactions
+
+        def within(key):
+            support = patterns.get(frozenset(key))
+            return support is not None and min_support <= support <= max_support
+
+        bounded = {}
+        for pattern, support in patterns.items():
+            key = sorted(pattern)
+            if all(within(key[-idx:]) for idx in range(2, len(key) + 1)):
+                bounded[pattern] = support
+        for rank, item in enumerate(self.items):
+            if self.support[item]:
+                bounded[frozenset((rank,))] = self.support[item]
+
+        return bounded
+
+
+    def verify_patterns(self, patterns, min_support=0, max_support=1,
+            max_size=0, chunksize=65536):
+        '''count the exact supports of the patterns found in the sample and
+        of their negative border over every transaction
+
+        Patterns are kept as `Fpgrowth` keeps them: if every suffix of at
+        least two items, in rank order, has an exact support within bounds.
+
+        Parameters
+        ----------
+        patterns: dict{frozenset[int]: int}
+            Patterns as returned by `find_patterns`.
+
+        min_support: float
+
+        max_support: float
+
+        max_size: int
+
+        chunksize: int = 65536
+
+        Returns
+        -------
+        patterns: dict{frozenset[int]: int}
+            The verified patterns and their exact support.
+
+        missed: dict{frozenset[int]: int}
+            The patterns of the negative border that are frequent over every
+            transaction, and their exact support; patterns containing them
+            may be missing.  '''
+
+        border = self.negative_border(patterns, max_size)
+        candidates = [tuple(sorted(pattern)) for pattern in patterns
+            if len(pattern) > 1]
+        log.info(f'Verifying {len(candidates)} sampled patterns and '
+            f'{len(border)} negative border patterns.')
+        supports = self.count_patterns(candidates +
+            [key for key in border if len(key) > 1], chunksize=chunksize)
+        for rank, item in enumerate(self.items):
+            supports[(rank,)] = self.support[item]
+        verified = self.bound_patterns({frozenset(key): supports[key] 
+            for key in candidates}, min_support, max_support)
+
+        min_support = min_support * self.transactions
+        missed = {frozenset(key): supports[key] for key in border
+            if supports[key] >= max(min_support, 1)}
+        dropped = len(candidates) - sum(1 for key in verified if len(key) > 1)
+        log.info(f'Verified {len(verified)} patterns; dropped {dropped} '
+            'sampled patterns outside of the support bounds.')
+        if missed:
+            log.warning(f'{len(missed)} of {len(border)} negative border '
+                'patterns are frequent over every transaction, so patterns '
+                'containing them may be missing; sample more transactions '
+                'or raise the confidence.')
+            for pattern, support in list(missed.items())[:10]:
+                items = ', '.join(self.items[item] for item in sorted(pattern))
+                log.warning(f'Negative border pattern ({items}) has a support '
+                    f'of {support}.')
+        else:
+            log.info(f'None of the {len(border)} negative border patterns are '
+                'frequent; no pattern was missed by the sample.')
+
+        return verified, missed
@@ -1,8 +1,50 @@
-
+import gzip
+import csv
+import struct
 import logging as log
 import pandas as pd
 import numpy as np
 
+from itertools import groupby
+
+
+def multiopen(filepath, **kwargs):
+    'autodetect compressed file'
+
+    if filepath.split('.')[-1] == 'gz':
+        data = gzip.open(filepath, **kwargs)
+    else:
+        data = open(filepath, **kwargs)
+    return data
+
+
+def split_rows(rows, ranks, size):
+    '''split row/rank coordinates of a block of transactions into sorted
+    itemsets; ranks below zero are dropped
+
+    Parameters
+    ----------
+    rows: numpy.ndarray[int]
+        Row of every coordinate within the block, in ascending order.
+
+    ranks: numpy.ndarray[int]
+        Item rank of every coordinate.
+
+    size: int
+        Number of transactions in the block.
+
+    Yields
+    ------
+    itemset: list[int]  '''
+
+    keep = ranks >= 0
+    rows, ranks = rows[keep], ranks[keep]
+    order = np.lexsort((ranks, rows))
+    rows, ranks = rows[order], ranks[order].tolist()
+    bounds = np.searchsorted(rows, np.arange(size + 1)).tolist()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield ranks[start:stop]
+
 
 class Transaction:
 
@@ -21,4 +63,377 @@ class Transaction:
             usecols=lambda x: x != 'patient')
             
         return data
-        
\ No newline at end of file
+
+
+    @classmethod
+    def detect_format(self, filepath):
+        '''detect the layout of a transactions file from its header
+
+        Dense files have a transaction id column followed by one 0/1 column
+        per item. Sparse files list only the items each transaction has;
+        their header is "items", or "<id>,items" when the first column is a
+        transaction id. Binary stores written by `TransactionStore` are
+        recognized by their magic bytes.
+
+        Returns
+        -------
+        fmt: str
+            Either "dense", "sparse" or "csr".   '''
+
+        if TransactionStore.is_store(filepath):
+            return 'csr'
+        header = self.read_header(filepath)
+        if len(header) <= 2 and header[-1].strip().lower() == 'items':
+            return 'sparse'
+        return 'dense'
+
+
+    @classmethod
+    def read_header(self, filepath):
+        'read the header row of a transactions file'
+
+        csvfile = multiopen(filepath, mode='rt')
+        header = next(csv.reader(csvfile, delimiter=',', quotechar='"'))
+        csvfile.close()
+        return header
+
+
+    @classmethod
+    def dense_blocks(self, filepath, chunksize=65536):
+        '''read a dense 0/1 transactions file in blocks of rows
+
+        The first column is the transaction id and every other column is an
+        item. Only one block is held in memory at a time, so memory is
+        bounded by the chunk size rather than the file size.
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the csv file; gzipped if it ends with ".gz".
+
+        chunksize: int = 65536
+            Number of transactions per block.
+
+        Yields
+        ------
+        block: numpy.ndarray[uint8]
+            A (transactions, items) indicator matrix; columns are in the order
+            of the header returned by `read_header`.    '''
+
+        _, *items = self.read_header(filepath)
+        csvfile = multiopen(filepath, mode='rt')
+        csvfile.readline()
+        try:
+            reader = pd.read_csv(csvfile, delimiter=',', quotechar='"',
+                header=None, usecols=range(1, len(items) + 1), dtype=np.uint8,
+                chunksize=chunksize, engine='c')
+            for chunk in reader:
+                yield chunk.to_numpy(dtype=np.uint8)
+        except pd.errors.EmptyDataError:
+            log.warning(f'No transactions found in {filepath}.')
+        finally:
+            csvfile.close()
+
+
+    @classmethod
+    def sparse_rows(self, filepath):
+        '''stream the item lists of a sparse transactions file
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the csv file; gzipped if it ends with ".gz".
+
+        Yields
+        ------
+        items: list[str]
+            The items of a transaction, without its id and without
+            duplicates.   '''
+
+        skip = len(self.read_header(filepath)) - 1
+        csvfile = multiopen(filepath, mode='rt')
+        csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        next(csvreader)
+        try:
+            for row in csvreader:
+                yield list(dict.fromkeys(item for item in row[skip:] if item))
+        finally:
+            csvfile.close()
+
+
+    @classmethod
+    def itemsets(self, filepath, fmt='auto', chunksize=65536):
+        '''stream the item lists of a dense or sparse transactions file
+
+        Parameters
+        ----------
+        filepath: str
+            Path to the csv file; gzipped if it ends with ".gz".
+
+        fmt: str = 'auto'
+            Layout of the file, "dense" or "sparse"; "auto" detects it with
+            `detect_format`.
+
+        chunksize: int = 65536
+            Number of transactions per block when reading a dense file.
+
+        Yields
+        ------
+        items: list[str]
+            The items of a transaction.   '''
+
+        if fmt == 'auto':
+            fmt = self.detect_format(filepath)
+        if fmt == 'csr':
+            store = TransactionStore(filepath)
+            items = np.array(store.items, dtype=object)
+            for indptr, indices in store.blocks(chunksize):
+                for start, stop in zip(indptr[:-1].tolist(), indptr[1:].tolist()):
+                    yield items[indices[start:stop]].tolist()
+        elif fmt == 'sparse':
+            yield from self.sparse_rows(filepath)
+        elif fmt == 'dense':
+            _, *items = self.read_header(filepath)
+            items = np.array(items, dtype=object)
+            for block in self.dense_blocks(filepath, chunksize):
+                rows, cols = np.nonzero(block)
+                bounds = np.searchsorted(rows, np.arange(len(block) + 1))
+                for start, stop in zip(bounds[:-1], bounds[1:]):
+                    yield items[cols[start:stop]].tolist()
+        else:
+            raise ValueError('Transaction expected format to be "dense", '
+                f'"sparse", "csr" or "auto" but got "{fmt}".')
+
+
+class TransactionStore:
+    '''binary transactions container in compressed sparse row layout
+
+    Transactions are stored as item ids: the ids of transaction `i` are
+    `indices[indptr[i]:indptr[i+1]]`, and `items[id]` is the name of an
+    item. The arrays are opened with `numpy.memmap`, so a store is parsed
+    once and then shared through the page cache by every scan and process
+    that opens it, without copies.
+
+    The file starts with the magic bytes and a header of little-endian
+    uint64s (transactions, nonzeros, items, and the byte offsets of the
+    indptr array, the support array and the item dictionary), followed by
+    the uint32 indices, the uint64 indptr, the uint64 item supports and the
+    newline separated, utf-8 item dictionary.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the store to open.  '''
+
+    magic = b'KNOWCSR1'
+    header = struct.Struct('<8s6Q')
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as data:
+            (magic, rows, nnz, items, indptr, support, 
+                names) = self.header.unpack(data.read(self.header.size))
+            data.seek(names)
+            self.items = data.read().decode('utf-8').split('\n')
+        if magic != self.magic:
+            raise ValueError(f'File {filepath} is not a transaction store.')
+        self.items = self.items if items else []
+
+        self.indices = self.memmap(np.uint32, self.header.size, nnz)
+        self.indptr = self.memmap(np.uint64, indptr, rows + 1)
+        self.support = self.memmap(np.uint64, support, items)
+
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+
+    def memmap(self, dtype, offset, size):
+        'map an array of the store read only'
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.filepath, dtype=dtype, mode='r', 
+            offset=offset, shape=(size,))
+
+
+    @classmethod
+    def is_store(self, filepath):
+        'check whether a file is a transaction store'
+        with open(filepath, 'rb') as data:
+            return data.read(len(self.magic)) == self.magic
+
+
+    def blocks(self, chunksize=65536):
+        '''iterate over blocks of transactions
+
+        Yields
+        ------
+        block: tuple(numpy.ndarray[int64], numpy.ndarray[uint32])
+            The indptr of the block, rebased to start at zero, and the ids of
+            every item of the block.  '''
+
+        for start in range(0, len(self), chunksize):
+            stop = min(start + chunksize, len(self))
+            indptr = self.indptr[start:stop + 1].astype(np.int64)
+            indices = self.indices[indptr[0]:indptr[-1]]
+            yield indptr - indptr[0], indices
+
+
+    @classmethod
+    def write(self, filepath, blocks, items):
+        '''stream blocks of transactions into a new store
+
+        Parameters
+        ----------
+        filepath: str
+            Path of the store to write.
+
+        blocks: iterable[tuple(numpy.ndarray[int], numpy.ndarray[int])]
+            Blocks of transactions as arrays of transaction lengths and of
+            the item ids of the block, transaction after transaction.
+
+        items: list[str]
+            The item dictionary; may keep growing while blocks are consumed
+            since it is only written at the end.    '''
+
+        lengths = [np.zeros(1, dtype=np.uint64)]
+        support = np.zeros(0, dtype=np.uint64)
+        nnz = 0
+        count = 0
+        n = 1
+
+        data = open(filepath, 'wb')
+        data.write(b'\0' * self.header.size)
+        for length, indices in blocks:
+            indices = np.asarray(indices, dtype=np.uint32)
+            data.write(indices.tobytes())
+            lengths.append(np.asarray(length, dtype=np.uint64))
+            counts = np.bincount(indices, minlength=len(support))
+            support = np.pad(support, (0, len(counts) - len(support)))
+            support += counts.astype(np.uint64)
+            nnz += len(indices)
+            count += len(length)
+            if count >= n:
+                log.info(f'Stored transaction {count}.')
+                while n <= count:
+                    n <<= 1
+
+        support = np.pad(support, (0, len(items) - len(support)))
+        data.write(b'\0' * (-data.tell() % 8))
+        indptr = data.tell()
+        data.write(np.cumsum(np.concatenate(lengths), dtype=np.uint64).tobytes())
+        offset = data.tell()
+        data.write(support.tobytes())
+        names = data.tell()
+        data.write('\n'.join(items).encode('utf-8'))
+        data.seek(0)
+        data.write(self.header.pack(self.magic, count, nnz, len(items), 
+            indptr, offset, names))
+        data.close()
+
+        log.info(f'Stored {count} transactions with {nnz} items in {filepath}.')
+        return self(filepath)
+
+
+    @classmethod
+    def from_csv(self, source, filepath, fmt='auto', chunksize=65536):
+        '''convert a dense or sparse transactions csv file into a store
+
+        Parameters
+        ----------
+        source: str
+            Path to the transactions csv file.
+
+        filepath: str
+            Path of the store to write.
+
+        fmt: str = 'auto'
+            Layout of the csv file, "dense", "sparse" or "auto".
+
+        chunksize: int = 65536
+            Number of transactions to convert at a time.
+
+        Returns
+        -------
+        store: TransactionStore    '''
+
+        if fmt == 'auto':
+            fmt = Transaction.detect_format(source)
+
+        if fmt == 'dense':
+            _, *items = Transaction.read_header(source)
+            blocks = ((block.sum(axis=1), np.nonzero(block)[1]) 
+                for block in Transaction.dense_blocks(source, chunksize))
+            return self.write(filepath, blocks, items)
+
+        items = []
+        ids = {}
+        def encode():
+            for itemset in Transaction.sparse_rows(source):
+                for item in itemset:
+                    if item not in ids:
+                        ids[item] = len(items)
+                        items.append(item)
+                yield sorted(ids[item] for item in itemset)
+        return self.write(filepath, self.chunk(encode(), chunksize), items)
+
+
+    @classmethod
+    def from_population(self, population, filepath, source, chunksize=65536):
+        '''write the events of a generated population into a store; every
+        encounter is a transaction, including those without events, so the
+        store has as many transactions as the population has encounters
+
+        Parameters
+        ----------
+        population: Population
+            Population with generated encounters to fetch events from.
+
+        filepath: str
+            Path of the store to write.
+
+        source: list[str]
+            Types of events to include; see `Population.fetch_events`.
+
+        chunksize: int = 65536
+            Number of encounters to fetch at a time.
+
+        Returns
+        -------
+        store: TransactionStore    '''
+
+        items = []
+        ids = {}
+        def encode():
+            for offset in range(0, population.encounters, chunksize):
+                events = population.fetch_events(source, offset, chunksize)
+                found = 0
+                for _, rows in groupby(events, key=lambda row: row[0]):
+                    found += 1
+                    itemset = set()
+                    for _, item in rows:
+                        if item not in ids:
+                            ids[item] = len(items)
+                            items.append(item)
+                        itemset.add(ids[item])
+                    yield sorted(itemset)
+                size = min(chunksize, population.encounters - offset)
+                for _ in range(size - found):
+                    yield []
+        return self.write(filepath, self.chunk(encode(), chunksize), items)
+
+
+    @classmethod
+    def chunk(self, itemsets, chunksize):
+        'group a stream of item id lists into blocks for `write`'
+        lengths = []
+        indices = []
+        for itemset in itemsets:
+            lengths.append(len(itemset))
+            indices.extend(itemset)
+            if len(lengths) == chunksize:
+                yield lengths, indices
+                lengths = []
+                indices = []
+        if lengths:
+            yield lengths, indices
@@ -0,0 +1,150 @@
+import time
+import logging as log
+
+from multiprocessing import Array, Value
+from threading import Thread, Event
+from ctypes import c_uint64, c_int
+
+
+class ProgressUtil:
+    '''low overhead progress counters for multiprocessing runs
+
+    Every process claims its own slot of a shared array and counts outputs
+    locally, only writing its running total to the slot every `flush`
+    outputs (and when `flush` is called), so counting takes no locks. A
+    reporter thread in the parent sums the slots at a fixed wall clock
+    cadence and logs throughput and, once work units are reported with
+    `update`, an ETA.
+
+    Parameters
+    ----------
+    name: str
+        What is being counted, as used in the log; e.g. "pattern".
+
+    slots: int
+        Number of processes that may count, including the parent.
+
+    interval: float = 60
+        Seconds between progress reports.
+
+    flush: int = 4096
+        Number of outputs a process counts before writing its total.   '''
+
+    def __init__(self, name, slots, interval=60, flush=4096):
+        self.name = name
+        self.interval = interval
+        self.every = flush
+        self.counts = Array(c_uint64, slots, lock=False)
+        self.claimed = Value(c_int, 0)
+
+        self.slot = None
+        self.count = 0
+        self.flushed = 0
+
+        self.done = 0
+        self.total = None
+        self.unit = None
+        self.start = None
+        self.thread = None
+        self.stopped = None
+
+
+    def __getstate__(self):
+        'the reporter thread stays with the parent'
+        state = self.__dict__.copy()
+        state['thread'] = None
+        state['stopped'] = None
+        return state
+
+
+    def claim(self):
+        'claim a counter slot for the current process'
+        with self.claimed.get_lock():
+            self.slot = self.claimed.value % len(self.counts)
+            self.claimed.value += 1
+        self.count = 0
+        self.flushed = 0
+
+
+    def add(self, outputs=1):
+        'count outputs of the current process'
+        self.count += outputs
+        if self.count - self.flushed >= self.every:
+            self.flush()
+
+
+    def flush(self):
+        'write the count of the current process to its shared slot'
+        self.counts[self.slot] = self.count
+        self.flushed = self.count
+
+
+    def value(self):
+        'total number of outputs flushed by every process'
+        return sum(self.counts)
+
+
+    def update(self, done, total=None, unit=None):
+        '''report how much work the parent has seen completed, which is
+        used to estimate the time remaining
+
+        Parameters
+        ----------
+        done: int
+            Work units completed.
+
+        total: int = None
+            Work units in total, if changed.
+
+        unit: str = None
+            Name of the work units, if changed; e.g. "tasks".   '''
+
+        self.done = done
+        if total is not None:
+            self.total = total
+        if unit is not None:
+            self.unit = unit
+
+
+    def begin(self):
+        'claim a slot for the parent and start the reporter thread'
+        self.claim()
+        self.start = time.perf_counter()
+        self.stopped = Event()
+        self.thread = Thread(target=self.report_loop, daemon=True)
+        self.thread.start()
+
+
+    def end(self):
+        'stop the reporter thread and log the final count'
+        self.flush()
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        elapsed = time.perf_counter() - self.start
+        count = self.value()
+        rate = count / elapsed if elapsed else 0
+        log.info(f'Found {count} {self.name}s in {elapsed:.1f}s '
+            f'({rate:.0f} {self.name}s/s).')
+
+
+    def report_loop(self):
+        last = (self.start, 0)
+        while not self.stopped.wait(self.interval):
+            last = self.report(*last)
+
+
+    def report(self, since, previous):
+        'log throughput since the last report and the estimated time left'
+        now = time.perf_counter()
+        count = self.value()
+        rate = (count - previous) / (now - since) if now > since else 0
+        message = (f'Found {count} {self.name}s so far ({rate:.0f} '
+            f'{self.name}s/s)')
+        if self.total and self.done:
+            eta = (now - self.start) * (self.total - self.done) / self.done
+            message += (f'; {self.done}/{self.total} {self.unit} done, '
+                f'ETA {eta:.0f}s')
+        log.info(message + '.')
+        return now, count